@@ -1,7 +1,7 @@
 
 import discord
 from discord.ext import commands
-from random import randint
+from random import shuffle
 
 import aiohttp
 
@@ -12,54 +12,273 @@ from .utils import checks
 from PIL import Image,ImageDraw,ImageDraw2
 
 import os
+import io
+import base64
+import time
 import asyncio
 import sys
+from collections import OrderedDict, ChainMap
+from concurrent.futures import ThreadPoolExecutor
 
 try:
     from imgurpython import ImgurClient
     imgur_succeed = True
-except:
-    raise RuntimeError("imgurpython is not installed. Do 'pip3 install imgurpython' to use this cog.")
+except ImportError: #only needed to show hands through imgur
     imgur_succeed = False
 
-class Blackjack:
-
-    def __init__(self, bot):
+CARD_WIDTH = 56
+CARD_HEIGHT = 82
+MAX_HAND_SIZE = 5
+DEFAULT_CACHE_KB = 4096
+DEFAULT_WORKERS = 4
+DEFAULT_DECKS = 6
+DEFAULT_PENETRATION = 75 #percent of the shoe dealt before it's reshuffled
+
+#cards are ints, suit * 13 + rank index, everything about them is looked up by that
+SUITS = ("hearts", "diamonds", "clubs", "spades")
+RANKS = ("ace", "2", "3", "4", "5", "6", "7", "8", "9", "10", "jack", "queen", "king")
+RANK_VALUES = (11, 2, 3, 4, 5, 6, 7, 8, 9, 10, 10, 10, 10)
+DECK = range(len(SUITS) * len(RANKS))
+CARD_SUITS = tuple(SUITS[card // len(RANKS)] for card in DECK)
+CARD_RANKS = tuple(RANKS[card % len(RANKS)] for card in DECK)
+CARD_VALUES = tuple(RANK_VALUES[card % len(RANKS)] for card in DECK)
+CARD_SPRITES = tuple("{}_of_{}".format(CARD_RANKS[card], CARD_SUITS[card]) for card in DECK) #faces in the atlas
+
+class CardAtlas:
+    """Every card face and hand background, decoded once into a single image.
+
+    Rendering a hand only crops and pastes from memory and encodes the
+    result once."""
+
+    def __init__(self, path="data/blackjack"):
+        faces = sorted(f[:-4] for f in os.listdir(os.path.join(path, "playing_cards")) if f.endswith(".png"))
+        columns = 13
+        rows = -(-len(faces) // columns)
+        width = max(columns * CARD_WIDTH, MAX_HAND_SIZE * CARD_WIDTH)
+        self.image = Image.new("RGBA", (width, (rows + MAX_HAND_SIZE) * CARD_HEIGHT))
+        self.faces = {} #card name -> box in the atlas
+        self.backgrounds = {} #number of cards -> box in the atlas
+
+        for i, face in enumerate(faces):
+            x, y = (i % columns) * CARD_WIDTH, (i // columns) * CARD_HEIGHT
+            with Image.open(os.path.join(path, "playing_cards", face + ".png")) as img:
+                self.image.paste(img.convert("RGBA"), (x, y))
+            self.faces[face] = (x, y, x + CARD_WIDTH, y + CARD_HEIGHT)
+
+        for n in range(1, MAX_HAND_SIZE + 1):
+            y = (rows + n - 1) * CARD_HEIGHT
+            with Image.open(os.path.join(path, "hand", "{}_cards.png".format(n))) as img:
+                self.image.paste(img.convert("RGBA"), (0, y))
+                self.backgrounds[n] = (0, y, img.size[0], y + CARD_HEIGHT)
+
+    def render(self, names):
+        """PNG bytes of a hand showing the named cards, left to right"""
+        if len(names) in self.backgrounds:
+            hand = self.image.crop(self.backgrounds[len(names)])
+        else: #longer than any background, every slot gets covered by a card anyway
+            hand = Image.new("RGBA", (CARD_WIDTH * len(names), CARD_HEIGHT))
+        for count, name in enumerate(names):
+            if len(names) == 1: #a lone card goes in the second slot
+                count = 1
+            hand.paste(self.image.crop(self.faces[name]), (CARD_WIDTH * count, 0))
+        buffer = io.BytesIO()
+        hand.save(buffer, "PNG")
+        return buffer.getvalue()
+
+class Shoe:
+    """Several decks shuffled together and dealt in order.
+
+    Once penetration percent of the cards are dealt, needs_shuffle() is
+    true and the table reshuffles between rounds."""
+
+    def __init__(self, decks=DEFAULT_DECKS, penetration=DEFAULT_PENETRATION):
+        self.decks = decks
+        self.penetration = penetration
+        self.cards = bytearray(DECK) * decks
+        self.shuffle()
+
+    def __len__(self):
+        """Cards left"""
+        return len(self.cards) - self.position
+
+    def shuffle(self):
+        shuffle(self.cards)
+        self.position = 0
+        self.cut = len(self.cards) * self.penetration // 100
+
+    def needs_shuffle(self):
+        return self.position >= self.cut
+
+    def draw(self):
+        if self.position == len(self.cards): #only with a very deep cut, shuffle mid-round rather than run out
+            self.shuffle()
+        card = self.cards[self.position]
+        self.position += 1
+        return card
+
+class WorkerPool:
+    """Runs blocking image work on a few threads, off the event loop.
+
+    At most limit jobs run at once and the rest wait their turn. pending is
+    how many are waiting right now and peak the most that ever waited.
+    close() lets every job already handed in finish before the threads go."""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.executor = ThreadPoolExecutor(max_workers=limit)
+        self.slots = asyncio.Semaphore(limit)
+        self.pending = 0
+        self.running = 0
+        self.peak = 0
+        self.completed = 0
+        self.waited = 0.0 #seconds jobs spent waiting for a thread, in total
+        self.jobs = 0 #waiting or running
+        self.idle = asyncio.Event()
+        self.idle.set()
+
+    async def run(self, function, *args):
+        self.jobs += 1
+        self.idle.clear()
+        try:
+            return await self._run(function, *args)
+        finally:
+            self.jobs -= 1
+            if not self.jobs:
+                self.idle.set()
+
+    async def _run(self, function, *args):
+        start = time.perf_counter()
+        waiting = self.slots.locked()
+        if waiting:
+            self.pending += 1
+            self.peak = max(self.peak, self.pending)
+        try:
+            await self.slots.acquire()
+        finally:
+            if waiting:
+                self.pending -= 1
+        self.waited += time.perf_counter() - start
+        self.running += 1
+        try:
+            return await asyncio.get_event_loop().run_in_executor(self.executor, function, *args)
+        finally:
+            self.running -= 1
+            self.completed += 1
+            self.slots.release()
+
+    async def close(self):
+        """Shuts the threads down after the last job, callers must already be using another pool"""
+        await self.idle.wait()
+        await asyncio.get_event_loop().run_in_executor(None, self.executor.shutdown, True)
+
+class HandCache:
+    """Least recently used rendered hands, keyed by their card names.
+
+    Evicts the oldest hands once the stored images exceed budget bytes."""
+
+    def __init__(self, budget):
+        self.budget = budget
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.entries = OrderedDict()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, names):
+        """Cached image of the hand, or None"""
+        key = tuple(names)
+        data = self.entries.get(key)
+        if data is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return data
+
+    def put(self, names, data):
+        key = tuple(names)
+        if key not in self.entries and len(data) <= self.budget:
+            self.entries[key] = data
+            self.size += len(data)
+            self.trim()
+
+    def resize(self, budget):
+        self.budget = budget
+        self.trim()
+
+    def trim(self):
+        while self.size > self.budget:
+            key, data = self.entries.popitem(last=False)
+            self.size -= len(data)
+
+class ImageHost:
+    """Gets rendered hands in front of players, as the image of an embed
+
+    Blocking work should go through pool, when there is one."""
+
+    def __init__(self, pool=None):
+        self.pool = pool
+
+    async def send(self, bot, channel, em, data):
+        raise NotImplementedError()
+
+class AttachmentHost(ImageHost):
+    """Attaches the hand to the message itself, nothing touches the disk or a third party"""
+
+    filename = "hand.png"
+
+    async def send(self, bot, channel, em, data):
+        #send_file can't carry an embed, so it's added to the message afterwards
+        message = await bot.send_file(channel, io.BytesIO(data), filename=self.filename)
+        em.set_image(url="attachment://" + self.filename)
+        await bot.edit_message(message, embed=em)
+
+class UrlHost(ImageHost):
+    """Uploads the hand somewhere and links it from the embed"""
+
+    def upload(self, data):
+        """Returns the url of the uploaded PNG data"""
+        raise NotImplementedError()
+
+    async def send(self, bot, channel, em, data):
+        if self.pool is None:
+            url = self.upload(data)
+        else:
+            url = await self.pool.run(self.upload, data)
+        em.set_image(url=url)
+        await bot.send_message(channel, embed=em)
 
-        self.bot = bot
-        self.sttg_file_path = "data/blackjack/settings.json"
-        self.settings = dataIO.load_json("data/blackjack/settings.json")
+class ImgurHost(UrlHost):
 
-        self.game_state = "null"
-        self.timer = 0
-        self.players = {}
-        if imgur_succeed:
-            self.imgur_client = ImgurClient("8257f564396d82a", "824c63bbad5cf05a2329812d826809b435744b41")
+    def __init__(self, pool=None, client=None):
+        super().__init__(pool)
+        if client is None:
+            client = ImgurClient("8257f564396d82a", "824c63bbad5cf05a2329812d826809b435744b41")
+        self.client = client
 
-        self.deck = {}
+    def upload(self, data):
+        pic = self.client.make_request("POST", "upload", {"image" : base64.b64encode(data), "type" : "base64"}, True)
+        link = pic['link']
+        return link[0:8] + ('w' * 3) + link[9:len(link)]
 
-        for suit in ["hearts", "diamonds", "clubs", "spades"]:
-            self.deck[suit] = {}
-            for i in range(2, 11):
-                self.deck[suit][i] = {}
-                self.deck[suit][i]["rank"] = str(i)
-                self.deck[suit][i]["value"] = i
+IMAGE_HOSTS = {"attachment" : AttachmentHost, "imgur" : ImgurHost}
 
-            self.deck[suit][1] = {}
-            self.deck[suit][1]["rank"] = "ace"
-            self.deck[suit][1]["value"] = 11
+class Blackjack:
 
-            self.deck[suit][11] = {}
-            self.deck[suit][11]["rank"] = "jack"
-            self.deck[suit][11]["value"] = 10
+    def __init__(self, bot):
 
-            self.deck[suit][12] = {}
-            self.deck[suit][12]["rank"] = "queen"
-            self.deck[suit][12]["value"] = 10
+        self.bot = bot
+        self.sttg_file_path = "data/blackjack/settings.json"
+        self.settings = dataIO.load_json("data/blackjack/settings.json")
+        self.settings.setdefault("SERVERS", {}) #per server overrides of the settings above
 
-            self.deck[suit][13] = {}
-            self.deck[suit][13]["rank"] = "king"
-            self.deck[suit][13]["value"] = 10
+        self.tables = {} #(server id, channel id) -> table being played there
+        self.atlas = CardAtlas()
+        self.hand_cache = HandCache(self.settings.get("BLACKJACK_CACHE_KB", DEFAULT_CACHE_KB) * 1024)
+        self.workers = WorkerPool(self.settings.get("BLACKJACK_WORKERS", DEFAULT_WORKERS))
+        self.image_host = self.open_image_host(self.settings.get("BLACKJACK_IMAGE_HOST", "attachment"))
 
 
     @commands.group(pass_context=True,no_pm=True,name="blackjack", aliases=["bj"])
@@ -71,9 +290,10 @@ class Blackjack:
     @_blackjack.command(pass_context=True, no_pm=True)
     async def start(self, ctx):
         """Start a game of blackjack"""
-        if self.game_state == "null":
-            self.game_state = "pregame"
-            await self.blackjack_game(ctx)
+        table = self.get_table(ctx)
+        if table.game_state == "null":
+            self.tables[table.key] = table
+            table.start()
         else:
             await self.bot.say("A blackjack game is already in progress!")
 
@@ -81,11 +301,15 @@ class Blackjack:
     @checks.admin_or_permissions(manage_server=True)
     async def stop(self, ctx):
         """Stop the current game of blackjack (no refunds)"""
+        table = self.get_table(ctx)
 
-        if self.game_state == "null":
+        if table.game_state == "null":
             await self.bot.say("There is no game currently running")
         else:
-            self.game_state = "null"
+            table.game_state = "null"
+            table.forfeit = True
+            table.task.cancel()
+            await table.task
             await self.bot.say("**Blackjack has been stopped**")
 
 
@@ -93,44 +317,57 @@ class Blackjack:
     async def bet(self, ctx, bet: int):
         """Join the game of blackjack with your opening bet"""
         player = ctx.message.author
+        table = self.get_table(ctx)
+
+        bank = self.bot.get_cog('Economy').bank
+        hold = None
+        if player in table.players and table.players[player]["hold"] in bank.holds:
+            hold = table.players[player]["hold"] #rebetting before the round started
+
+        em = mesg = None
+        async with bank.lock(player): #messages go out once the lock is released
+            affordable = await bank.offload(bank.can_spend, player, bet, hold=hold) #a bank service is called from a worker thread
+            if affordable and table.game_state == "pregame":
+                if bet < table.settings["BLACKJACK_MIN"] or (bet > table.settings["BLACKJACK_MAX"] and table.settings["BLACKJACK_MAX_ENABLED"]):
+                    mesg = "{0}, bet must be between {1} and {2}.".format(player.name, table.settings["BLACKJACK_MIN"], table.settings["BLACKJACK_MAX"])
+                else:
+                    em = discord.Embed(title = '', description = '', colour= 0x95270e)
+                    em.set_author(name = player.name, icon_url = player.avatar_url)
 
-        if self.bot.get_cog('Economy').bank.can_spend(player, bet) and self.game_state == "pregame":
-            if bet < self.settings["BLACKJACK_MIN"] or (bet > self.settings["BLACKJACK_MAX"] and self.settings["BLACKJACK_MAX_ENABLED"]):
-                await self.bot.say("{0}, bet must be between {1} and {2}.".format(player.name, self.settings["BLACKJACK_MIN"], self.settings["BLACKJACK_MAX"]))
-            else:
-                em = discord.Embed(title = '', description = '', colour= 0x95270e)
-                em.set_author(name = player.name, icon_url = player.avatar_url)
+                    if hold is None:
+                        em.add_field(name = 'Bet Placed', value = '{0}'.format(bet))
+                        hold = await bank.offload(bank.reserve, player, bet, tag="blackjack")
 
-                if not (player in self.players.keys()):
-                    em.add_field(name = 'Bet Placed', value = '{0}'.format(bet))
-                    self.bot.get_cog('Economy').bank.withdraw_credits(player, bet)
+                    else:
+                        em.add_field(name = 'Bet Placed', value = '{0}'.format(bet))
+                        await bank.offload(bank.adjust_hold, hold, bet)
 
-                else:
-                    em.add_field(name = 'Bet Placed', value = '{0}'.format(bet))
-                    self.bot.get_cog('Economy').bank.deposit_credits(player, bet)
-                    self.bot.get_cog('Economy').bank.withdraw_credits(player, bet)
+                    table.players[player] = {}
+                    table.players[player]["hold"] = hold #credits stay in the bank until the round settles
+                    table.players[player]["curr_hand"] = 0
+                    table.players[player]["hand"] = {}
+                    table.players[player]["hand"][0] = {}
+                    table.players[player]["hand"][0]["card"] = {}
+                    table.players[player]["hand"][0]["ranks"] = []
+                    table.players[player]["hand"][0]["bet"] = bet
+                    table.players[player]["hand"][0]["standing"] = False
+                    table.players[player]["hand"][0]["blackjack"] = False
 
-                self.players[player] = {}
-                self.players[player]["curr_hand"] = 0
-                self.players[player]["hand"] = {}
-                self.players[player]["hand"][0] = {}
-                self.players[player]["hand"][0]["card"] = {}
-                self.players[player]["hand"][0]["ranks"] = []
-                self.players[player]["hand"][0]["bet"] = bet
-                self.players[player]["hand"][0]["standing"] = False
-                self.players[player]["hand"][0]["blackjack"] = False
+                    em.add_field(name = 'Current Balance', value = '{0}'.format(await bank.offload(bank.get_available, player)))
 
-                em.add_field(name = 'Current Balance', value = '{0}'.format(self.bot.get_cog('Economy').bank.get_balance(player)))
-                await self.bot.send_message(ctx.message.channel, embed = em)
+            elif table.game_state == "null":
+                mesg = "There is currently no game running, type `r!!blackjack start` to begin one"
 
-        elif self.game_state == "null":
-            await self.bot.say("There is currently no game running, type `r!!blackjack start` to begin one")
+            elif table.game_state != "pregame" and table.game_state != "null":
+                mesg = "There is currently a game in progress, wait for the next game"
 
-        elif self.game_state != "pregame" and self.game_state != "null":
-            await self.bot.say("There is currently a game in progress, wait for the next game")
+            elif not affordable:
+                mesg = "{0}, you need an account with enough funds to play blackjack".format(player.name)
 
-        elif not self.bot.get_cog('Economy').bank.can_spend(player, bet):
-            await self.bot.say("{0}, you need an account with enough funds to play blackjack".format(player.name))
+        if em is not None:
+            await self.bot.send_message(ctx.message.channel, embed = em)
+        elif mesg is not None:
+            await self.bot.say(mesg)
 
     @commands.command(pass_context=True, no_pm=True, name="bet")
     async def _clean_bet(self,ctx,bt: int):
@@ -140,22 +377,23 @@ class Blackjack:
     async def hit(self, ctx):
         """Hit and draw another card"""
         player = ctx.message.author
+        table = self.get_table(ctx)
 
-        card = await self.draw_card(player)
-        curr_hand = self.players[player]["curr_hand"]
-        ranks = self.players[player]["hand"][curr_hand]["ranks"]
-        count = await self.count_hand(player, curr_hand)
+        card = await table.draw_card(player)
+        curr_hand = table.players[player]["curr_hand"]
+        ranks = table.players[player]["hand"][curr_hand]["ranks"]
+        count = await table.count_hand(player, curr_hand)
 
-        if self.game_state == "game" and self.players[player]["hand"][curr_hand]["standing"] == False:
+        if table.game_state == "game" and table.players[player]["hand"][curr_hand]["standing"] == False:
 
-            if count > 21 and len(self.players[player]["hand"]) == self.players[player]["curr_hand"] + 1:
+            if count > 21 and len(table.players[player]["hand"]) == table.players[player]["curr_hand"] + 1:
                 mesg = "{0} has **busted**!".format(player.name)
-                self.players[player]["hand"][curr_hand]["standing"] = True
+                table.players[player]["hand"][curr_hand]["standing"] = True
 
-            elif count > 21 and len(self.players[player]["hand"]) > self.players[player]["curr_hand"] + 1:
+            elif count > 21 and len(table.players[player]["hand"]) > table.players[player]["curr_hand"] + 1:
                 mesg = "{0} has **busted** on their current hand! Moving on to next split hand!".format(player.name)
-                self.players[player]["curr_hand"] += 1
-                self.players[player]["hand"][curr_hand]["standing"] = True
+                table.players[player]["curr_hand"] += 1
+                table.players[player]["hand"][curr_hand]["standing"] = True
 
             elif "ace" in ranks:
                 mesg = "{0} has hit and drawn a {1}, totaling their hand to {2} ({3})".format(player.name, card, str(count), str(count - 10))
@@ -163,13 +401,13 @@ class Blackjack:
             else:
                 mesg = "{0} has hit and drawn a {1}, totaling their hand to {2}".format(player.name, card, count)
 
-            if self.settings["BLACKJACK_IMAGES_ENABLED"]:
-                await self.show_hand(player, curr_hand, ctx.message, mesg)
+            if table.settings["BLACKJACK_IMAGES_ENABLED"]:
+                await table.show_hand(player, curr_hand, mesg)
 
-        elif self.game_state != "game":
+        elif table.game_state != "game":
             await self.bot.say("{0}, you cannot hit right now".format(player.name))
 
-        elif self.players[player]["hand"][curr_hand]["standing"]:
+        elif table.players[player]["hand"][curr_hand]["standing"]:
             await self.bot.say("{0}, you are standing and cannot hit".format(player.name))
 
 
@@ -182,23 +420,24 @@ class Blackjack:
     async def stand(self, ctx):
         """Finishing drawing and stand with your current cards"""
         player = ctx.message.author
-        curr_hand = self.players[player]["curr_hand"]
-        if self.game_state == "game" and not self.players[player]["hand"][curr_hand]["standing"]:
-            count = await self.count_hand(player, self.players[player]["curr_hand"])
+        table = self.get_table(ctx)
+        curr_hand = table.players[player]["curr_hand"]
+        if table.game_state == "game" and not table.players[player]["hand"][curr_hand]["standing"]:
+            count = await table.count_hand(player, table.players[player]["curr_hand"])
 
-            if len(self.players[player]["hand"]) == self.players[player]["curr_hand"] + 1:
+            if len(table.players[player]["hand"]) == table.players[player]["curr_hand"] + 1:
                 await self.bot.say("{0} has stood with a hand totaling to {1}".format(player.name, str(count)))
 
             else:
                 await self.bot.say("{0} has stood with a hand totaling to {1}. Moving on to next split hand!".format(player.name, str(count)))
-                self.players[player]["curr_hand"] += 1
+                table.players[player]["curr_hand"] += 1
 
-            self.players[player]["hand"][curr_hand]["standing"] = True
+            table.players[player]["hand"][curr_hand]["standing"] = True
 
-        elif self.game_state != "game":
+        elif table.game_state != "game":
             await self.bot.say("{0}, you cannot stand right now".format(player.name))
 
-        elif self.players[player]["hand"][curr_hand]["standing"]:
+        elif table.players[player]["hand"][curr_hand]["standing"]:
             await self.bot.say("{0}, you are already standing".format(player.name))
 
 
@@ -210,48 +449,60 @@ class Blackjack:
     async def double(self, ctx):
         """Double your original bet and draw one last card"""
         player = ctx.message.author
-        curr_hand = self.players[player]["curr_hand"]
-        bet = self.players[player]["hand"][curr_hand]["bet"]
+        table = self.get_table(ctx)
+        curr_hand = table.players[player]["curr_hand"]
+        bet = table.players[player]["hand"][curr_hand]["bet"]
 
-        if self.bot.get_cog('Economy').bank.can_spend(player, bet) and not self.players[player]["hand"][curr_hand]["standing"] and self.game_state == "game":
+        bank = self.bot.get_cog('Economy').bank
+        announce = mesg = None
+        async with bank.lock(player): #messages go out once the lock is released
+            affordable = await bank.offload(bank.can_spend, player, bet)
+            if affordable and not table.players[player]["hand"][curr_hand]["standing"] and table.game_state == "game":
 
-            mesg = await self.bot.say("{0} has doubled down, totaling their bet to {1}".format(player.name, self.players[player]["hand"][curr_hand]["bet"]))
+                announce = "{0} has doubled down, totaling their bet to {1}".format(player.name, table.players[player]["hand"][curr_hand]["bet"])
 
-            self.players[player]["hand"][curr_hand]["bet"] += bet
-            self.bot.get_cog('Economy').bank.withdraw_credits(player, bet)
+                table.players[player]["hand"][curr_hand]["bet"] += bet
+                hold = table.players[player]["hold"]
+                await bank.offload(bank.adjust_hold, hold, bank.hold_amount(hold) + bet)
 
-            card = await self.draw_card(player)
-            count = await self.count_hand(player, self.players[player]["curr_hand"])
+                card = await table.draw_card(player)
+                count = await table.count_hand(player, table.players[player]["curr_hand"])
 
-            if count > 21 and len(self.players[player]["hand"]) == self.players[player]["curr_hand"] + 1:
-                mesg = "{0} has **busted**!".format(player.name)
-                self.players[player]["hand"][curr_hand]["standing"] = True
+                if count > 21 and len(table.players[player]["hand"]) == table.players[player]["curr_hand"] + 1:
+                    mesg = "{0} has **busted**!".format(player.name)
+                    table.players[player]["hand"][curr_hand]["standing"] = True
+
+                elif count > 21 and len(table.players[player]["hand"]) > table.players[player]["curr_hand"] + 1:
+                    mesg = "{0} has **busted**! Moving on to next split hand!".format(player.name)
+                    table.players[player]["curr_hand"] += 1
+                    table.players[player]["hand"][curr_hand]["standing"] = True
 
-            elif count > 21 and len(self.players[player]["hand"]) > self.players[player]["curr_hand"] + 1:
-                mesg = "{0} has **busted**! Moving on to next split hand!".format(player.name)
-                self.players[player]["curr_hand"] += 1
-                self.players[player]["hand"][curr_hand]["standing"] = True
+                elif count < 21 and len(table.players[player]["hand"]) == table.players[player]["curr_hand"] + 1:
+                    mesg = "{0} has doubled and drawn a {1}, totaling their hand to {2}".format(player.name, card, count)
+                    table.players[player]["hand"][curr_hand]["standing"] = True
 
-            elif count < 21 and len(self.players[player]["hand"]) == self.players[player]["curr_hand"] + 1:
-                mesg = "{0} has doubled and drawn a {1}, totaling their hand to {2}".format(player.name, card, count)
-                self.players[player]["hand"][curr_hand]["standing"] = True
+                elif count < 21 and len(table.players[player]["hand"]) > table.players[player]["curr_hand"] + 1:
+                    mesg = "{0} has doubled and drawn a {1}, totaling their hand to {2}. Moving on to next split hand!".format(player.name, card, count)
+                    table.players[player]["curr_hand"] += 1
+                    table.players[player]["hand"][curr_hand]["standing"] = True
 
-            elif count < 21 and len(self.players[player]["hand"]) > self.players[player]["curr_hand"] + 1:
-                mesg = "{0} has doubled and drawn a {1}, totaling their hand to {2}. Moving on to next split hand!".format(player.name, card, count)
-                self.players[player]["curr_hand"] += 1
-                self.players[player]["hand"][curr_hand]["standing"] = True
+            elif table.game_state != "game":
+                mesg = "{0}, you cannot double down right now!".format(player.name)
 
-            if self.settings["BLACKJACK_IMAGES_ENABLED"]:
-                await self.show_hand(player, curr_hand, ctx.message, mesg)
+            elif table.players[player]["hand"][curr_hand]["standing"]:
+                mesg = "{0}, you are standing and cannot double!".format(player.name)
 
-        elif self.game_state != "game":
-            await self.bot.say("{0}, you cannot double down right now!".format(player.name))
+            elif not affordable:
+                mesg = "{0}, you do not have enough money to double down!".format(player.name)
 
-        elif self.players[player]["hand"][curr_hand]["standing"]:
-            await self.bot.say("{0}, you are standing and cannot double!".format(player.name))
+        if announce is None:
+            if mesg is not None:
+                await self.bot.say(mesg)
+            return
 
-        elif not self.bot.get_cog('Economy').bank.can_spend(player, bet):
-            await self.bot.say("{0}, you do not have enough money to double down!".format(player.name))
+        await self.bot.say(announce)
+        if table.settings["BLACKJACK_IMAGES_ENABLED"]:
+            await table.show_hand(player, curr_hand, mesg)
 
     @commands.command(pass_context=True, no_pm=True, name="double")
     async def _clean_double(self,ctx):
@@ -261,9 +512,10 @@ class Blackjack:
     async def split(self, ctx):
         """Split your hand into two seperate hands if you have two cards of the same rank"""
         player = ctx.message.author
+        table = self.get_table(ctx)
 
-        curr_hand = self.players[player]["curr_hand"]
-        cards = self.players[player]["hand"][curr_hand]["card"]
+        curr_hand = table.players[player]["curr_hand"]
+        cards = table.players[player]["hand"][curr_hand]["card"]
 
         if (cards[0]["value"] == 11 and cards[1]["value"] == 1) or (cards[0]["value"] == 1 and cards[1]["value"] == 11): #reset aces to orginal value
             cards[0]["value"] = 11
@@ -272,27 +524,27 @@ class Blackjack:
             cards[1]["value"] = 11
             cards[1]["rank"] = "ace"
 
-        if cards[0]["value"] == cards[1]["value"] and len(cards) == 2 and self.game_state == "game" and not self.players[player]["hand"][curr_hand]["standing"]:
+        if cards[0]["value"] == cards[1]["value"] and len(cards) == 2 and table.game_state == "game" and not table.players[player]["hand"][curr_hand]["standing"]:
             await self.bot.say( "{0} has split their {1}'s! Play through your first hand and stand to begin your next!".format(player.name, cards[0]["value"]))
-            hand_index = len(self.players[player]["hand"])
+            hand_index = len(table.players[player]["hand"])
 
-            self.players[player]["hand"][hand_index] = {}
-            self.players[player]["hand"][hand_index]["card"] = {}
-            self.players[player]["hand"][hand_index]["ranks"] = []
-            self.players[player]["hand"][hand_index]["bet"] = self.players[player]["hand"][curr_hand]["bet"]
-            self.players[player]["hand"][hand_index]["standing"] = False
-            self.players[player]["hand"][hand_index]["blackjack"] = False
+            table.players[player]["hand"][hand_index] = {}
+            table.players[player]["hand"][hand_index]["card"] = {}
+            table.players[player]["hand"][hand_index]["ranks"] = []
+            table.players[player]["hand"][hand_index]["bet"] = table.players[player]["hand"][curr_hand]["bet"]
+            table.players[player]["hand"][hand_index]["standing"] = False
+            table.players[player]["hand"][hand_index]["blackjack"] = False
 
-            self.players[player]["hand"][hand_index]["card"][0] = cards[1]
+            table.players[player]["hand"][hand_index]["card"][0] = cards[1]
             del cards[1]
 
-            if self.settings["BLACKJACK_IMAGES_ENABLED"]:
-                await self.show_hand(player, curr_hand, ctx.message, " ")
+            if table.settings["BLACKJACK_IMAGES_ENABLED"]:
+                await table.show_hand(player, curr_hand, " ")
 
-        elif self.game_state != "game":
+        elif table.game_state != "game":
             await self.bot.say("{0}, you cannot split right now!".format(player.name))
 
-        elif self.players[player]["hand"][curr_hand]["standing"]:
+        elif table.players[player]["hand"][curr_hand]["standing"]:
             await self.bot.say("{0}, you are standing and cannot split!".format(player.name))
 
         elif len(cards) != 2:
@@ -306,22 +558,263 @@ class Blackjack:
     async def _clean_split(self,ctx):
         await ctx.invoke(self.split)
 
-    async def blackjack_game(self, ctx):
+    def open_image_host(self, name):
+        if name == "imgur" and not imgur_succeed:
+            print("imgurpython is not installed, blackjack hands will be sent as attachments instead. "
+                  "Do 'pip3 install imgurpython' to use imgur.")
+            name = "attachment"
+        return IMAGE_HOSTS[name](self.workers)
+
+    def get_table(self, ctx):
+        """The table in ctx's channel, or a new idle one if there's no game there"""
+        server = ctx.message.server
+        table = self.tables.get((server.id, ctx.message.channel.id))
+        if table is None:
+            table = Table(self, server, ctx.message.channel, self.server_settings(server))
+        return table
+
+    def server_settings(self, server):
+        """server's settings, changes only apply to that server"""
+        return ChainMap(self.settings["SERVERS"].setdefault(server.id, {}), self.settings)
+
+    def __unload(self):
+        for table in self.tables.values():
+            table.task.cancel() #bets still held are given back
+        self.bot.loop.create_task(self.workers.close())
+
+    # async def delete_messages(self, ctx):
+    #     server = ctx.message.server
+    #     user = ctx.message.server.me
+    #     message = ctx.message
+    #     if x.author.id == user.id:
+    #         await self.bot.delete_message(x)
+    #     await self.bot.delete_message(cmdmsg)
+
+
+    @commands.group(pass_context=True, no_pm=True)
+    @checks.admin_or_permissions(manage_server=True)
+    async def blackjackset(self, ctx):
+        """Changes blackjack settings"""
+        if ctx.invoked_subcommand is None:
+            msg = "```"
+            for k, v in sorted(self.server_settings(ctx.message.server).items()):
+                if k != "SERVERS":
+                    msg += str(k) + ": " + str(v) + "\n"
+            msg += "\nType {}help blackjackset to see the list of commands.```".format(ctx.prefix)
+            await self.bot.say(msg)
+
+
+    @blackjackset.command(pass_context=True)
+    async def blackjackmin(self, ctx, bet : int):
+        """Minimum blackjack bet"""
+        settings = self.server_settings(ctx.message.server)
+        settings["BLACKJACK_MIN"] = bet
+        await self.bot.say("Minimum bet is now " + str(bet) + " credits.")
+        dataIO.save_json(self.sttg_file_path, self.settings)
+
+    @blackjackset.command(pass_context=True)
+    async def blackjackmax(self, ctx, bet : int):
+        """Maximum blackjack bet"""
+        settings = self.server_settings(ctx.message.server)
+        settings["BLACKJACK_MAX"] = bet
+        await self.bot.say("Maximum bet is now " + str(bet) + " credits.")
+        dataIO.save_json(self.sttg_file_path, self.settings)
+
+    @blackjackset.command(pass_context=True)
+    async def blackjackmaxtoggle(self, ctx):
+        """Toggle the use of a maximum blackjack bet"""
+        settings = self.server_settings(ctx.message.server)
+        settings["BLACKJACK_MAX_ENABLED"] = not settings["BLACKJACK_MAX_ENABLED"]
+        if settings["BLACKJACK_MAX_ENABLED"]:
+            await self.bot.say("Maximum bet is now enabled.")
+        else:
+            await self.bot.say("Maximum bet is now disabled.")
+        dataIO.save_json(self.sttg_file_path, self.settings)
+
+    @blackjackset.command(pass_context=True)
+    async def blackjackpretime(self, ctx, time : int):
+        """Set the pregame time for players to bet"""
+        settings = self.server_settings(ctx.message.server)
+        settings["BLACKJACK_PRE_GAME_TIME"] = time
+        await self.bot.say("Blackjack pre-game time is now " + str(time))
+        dataIO.save_json(self.sttg_file_path, self.settings)
+
+    @blackjackset.command(pass_context=True)
+    async def blackjacktime(self, ctx, time : int):
+        """Set the maximum game time given to hit"""
+        settings = self.server_settings(ctx.message.server)
+        settings["BLACKJACK_GAME_TIME"] = time
+        await self.bot.say("Blackjack maximum game time is now " + str(time))
+        dataIO.save_json(self.sttg_file_path, self.settings)
+
+    @blackjackset.command(pass_context=True)
+    async def blackjackimagestoggle(self, ctx):
+        """Toggle the use of card images"""
+        settings = self.server_settings(ctx.message.server)
+        settings["BLACKJACK_IMAGES_ENABLED"] = not settings["BLACKJACK_IMAGES_ENABLED"]
+        if settings["BLACKJACK_IMAGES_ENABLED"]:
+            await self.bot.say("Card images are now enabled.")
+        else:
+            await self.bot.say("Card images are now disabled.")
+        dataIO.save_json(self.sttg_file_path, self.settings)
+
+    @blackjackset.command(pass_context=True)
+    async def blackjackdecks(self, ctx, decks : int):
+        """Number of decks in the shoe, used from the next shuffle"""
+        settings = self.server_settings(ctx.message.server)
+        if not 1 <= decks <= 8:
+            await self.bot.say("The shoe holds between 1 and 8 decks.")
+            return
+        settings["BLACKJACK_DECKS"] = decks
+        await self.bot.say("The shoe now holds " + str(decks) + " decks.")
+        dataIO.save_json(self.sttg_file_path, self.settings)
+
+    @blackjackset.command(pass_context=True)
+    async def blackjackpenetration(self, ctx, percent : int):
+        """How much of the shoe is dealt before reshuffling, in percent"""
+        settings = self.server_settings(ctx.message.server)
+        if not 10 <= percent <= 100:
+            await self.bot.say("Penetration must be between 10 and 100 percent.")
+            return
+        settings["BLACKJACK_PENETRATION"] = percent
+        await self.bot.say("The shoe is now reshuffled after " + str(percent) + "% of it is dealt.")
+        dataIO.save_json(self.sttg_file_path, self.settings)
+
+    @blackjackset.command()
+    @checks.is_owner()
+    async def blackjackimagehost(self, host : str):
+        """Where card images go: attachment or imgur"""
+        host = host.lower()
+        if host not in IMAGE_HOSTS:
+            await self.bot.say("Image host must be one of: " + ", ".join(IMAGE_HOSTS))
+            return
+        if host == "imgur" and not imgur_succeed:
+            await self.bot.say("imgurpython is not installed. Do 'pip3 install imgurpython' to use imgur.")
+            return
+        self.settings["BLACKJACK_IMAGE_HOST"] = host
+        self.image_host = self.open_image_host(host)
+        await self.bot.say("Card images are now sent through " + host + ".")
+        dataIO.save_json(self.sttg_file_path, self.settings)
+
+    @blackjackset.command()
+    @checks.is_owner()
+    async def blackjackworkers(self, threads : int=None):
+        """Threads drawing and uploading card images, shows their load if left empty"""
+        pool = self.workers
+        if threads is None:
+            await self.bot.say("{0} of {1} threads busy, {2} images waiting (at most {3} so far). {4} images done, waiting {5:.0f} ms on average.".format(
+                pool.running, pool.limit, pool.pending, pool.peak, pool.completed, pool.waited * 1000 / pool.completed if pool.completed else 0))
+            return
+        self.settings["BLACKJACK_WORKERS"] = max(1, threads)
+        self.workers = WorkerPool(self.settings["BLACKJACK_WORKERS"])
+        self.image_host.pool = self.workers
+        self.bot.loop.create_task(pool.close()) #renders already queued on the old pool still finish there
+        await self.bot.say("Card images now use up to " + str(self.settings["BLACKJACK_WORKERS"]) + " threads.")
+        dataIO.save_json(self.sttg_file_path, self.settings)
+
+    @blackjackset.command()
+    @checks.is_owner()
+    async def blackjackcache(self, kilobytes : int=None):
+        """Memory for rendered hands in KB, shows cache stats if left empty"""
+        cache = self.hand_cache
+        if kilobytes is None:
+            total = cache.hits + cache.misses
+            await self.bot.say("{0} hands cached using {1} of {2} KB. {3} hits, {4} misses ({5:.0%} hit rate).".format(
+                len(cache), cache.size // 1024, cache.budget // 1024, cache.hits, cache.misses, cache.hits / total if total else 0))
+            return
+        self.settings["BLACKJACK_CACHE_KB"] = max(0, kilobytes)
+        cache.resize(self.settings["BLACKJACK_CACHE_KB"] * 1024)
+        await self.bot.say("Rendered hands can now use up to " + str(self.settings["BLACKJACK_CACHE_KB"]) + " KB.")
+        dataIO.save_json(self.sttg_file_path, self.settings)
+
+    @blackjackset.command(pass_context=True)
+    async def paydaytime(self, ctx, seconds : int):
+        """Seconds between each payday"""
+        settings = self.server_settings(ctx.message.server)
+        settings["PAYDAY_TIME"] = seconds
+        await self.bot.say("Value modified. At least " + str(seconds) + " seconds must pass between each payday.")
+        dataIO.save_json(self.sttg_file_path, self.settings)
+
+    @blackjackset.command(pass_context=True)
+    async def paydaycredits(self, ctx, credits : int):
+        """Credits earned each payday"""
+        settings = self.server_settings(ctx.message.server)
+        settings["PAYDAY_CREDITS"] = credits
+        await self.bot.say("Every payday will now give " + str(credits) + " credits.")
+
+
+
+class Table:
+    """A game of blackjack in one channel, with its own players, state and task"""
+
+    def __init__(self, cog, server, channel, settings):
+        self.cog = cog
+        self.bot = cog.bot
+        self.key = (server.id, channel.id)
+        self.channel = channel
+        self.settings = settings
+        self.game_state = "null"
+        self.timer = 0
+        self.players = {}
+        self.shoe = Shoe(settings.get("BLACKJACK_DECKS", DEFAULT_DECKS),
+                         settings.get("BLACKJACK_PENETRATION", DEFAULT_PENETRATION))
+        self.task = None
+        self.forfeit = False #whether held bets are taken or given back if the game is cut short
+
+    def start(self):
+        self.game_state = "pregame"
+        self.task = self.bot.loop.create_task(self.run())
+
+    async def run(self):
+        try:
+            await self.blackjack_game()
+        except asyncio.CancelledError:
+            pass
+        finally:
+            bank = self.bot.get_cog('Economy').bank
+            forfeits = bank.transaction()
+            for player in self.players:
+                if player != self.bot and self.players[player]["hold"] in bank.holds:
+                    if self.forfeit:
+                        forfeits.capture(self.players[player]["hold"])
+                    else:
+                        bank.release(self.players[player]["hold"])
+            try:
+                await bank.offload(forfeits.commit)
+            finally:
+                if self.cog.tables.get(self.key) is self:
+                    del self.cog.tables[self.key]
+
+    async def say(self, content):
+        return await self.bot.send_message(self.channel, content)
+
+    def stake(self, player):
+        """Credits player has bet this round, over all of their hands"""
+        return sum(hand["bet"] for hand in self.players[player]["hand"].values())
+
+    async def blackjack_game(self):
         while self.game_state != "null":
             if self.game_state == "pregame":
-                self.players = {}
+                holds = self.bot.get_cog('Economy').bank.holds
+                self.players = {player: self.players[player] for player in self.players #keep bets already placed for this round
+                                if player != self.bot and self.players[player]["hold"] in holds}
                 self.timer = 0
-                asdf = await self.bot.say(":moneybag::hearts:             `Blackjack started!`              :diamonds::moneybag:\n:moneybag:`Place your bets now to join the round!`:moneybag:")
+                decks = self.settings.get("BLACKJACK_DECKS", DEFAULT_DECKS)
+                if self.shoe.decks != decks or self.shoe.needs_shuffle(): #reached the cut card
+                    self.shoe = Shoe(decks, self.settings.get("BLACKJACK_PENETRATION", DEFAULT_PENETRATION))
+                    await self.say("*The dealer shuffles a new shoe of {0} decks*".format(decks))
+                await self.say(":moneybag::hearts:             `Blackjack started!`              :diamonds::moneybag:\n:moneybag:`Place your bets now to join the round!`:moneybag:")
                 await asyncio.sleep(self.settings["BLACKJACK_PRE_GAME_TIME"])
 
             if self.game_state == "pregame":
                 if len(self.players) == 0:
-                    await self.bot.say("No bets made, aborting game!")
+                    await self.say("No bets made, aborting game!")
                     self.game_state = "null"
                 else:
                     self.game_state = "drawing"
 
             if self.game_state == "drawing":
+                shown = []
                 for player in self.players:
 
                     card1 = await self.draw_card(player)
@@ -343,8 +836,12 @@ class Blackjack:
                     else:
                         desc = "{0} has drawn a {1} and a {2}, totaling to {3}!".format(player.name, card1, card2, str(count))
 
-                    if self.settings["BLACKJACK_IMAGES_ENABLED"]:
-                            await self.show_hand(player, curr_hand, ctx.message, desc)
+                    shown.append((player, curr_hand, desc))
+
+                if self.settings["BLACKJACK_IMAGES_ENABLED"]: #render everyone's hand at once, then show them in order
+                    hands = await asyncio.gather(*[self.render_hand(player, curr_hand) for player, curr_hand, desc in shown])
+                    for (player, curr_hand, desc), data in zip(shown, hands):
+                        await self.send_hand(player, desc, data)
 
                 self.players[self.bot] = {}
                 self.players[self.bot]["curr_hand"] = 0
@@ -358,7 +855,7 @@ class Blackjack:
                 desc = "**The dealer has drawn a {0}!**".format(card)
 
                 if self.settings["BLACKJACK_IMAGES_ENABLED"]:
-                    await self.show_hand(self.bot, curr_hand, asdf, desc)
+                    await self.show_hand(self.bot, curr_hand, desc)
 
                 self.game_state = "game"
 
@@ -393,29 +890,35 @@ class Blackjack:
                         desc = "**The dealer has drawn a {0}, totaling his hand to {1}!**".format(card, str(dealer_count))
 
                     if self.settings["BLACKJACK_IMAGES_ENABLED"]:
-                        await self.show_hand(self.bot, curr_hand, ctx.message, desc)
+                        await self.show_hand(self.bot, curr_hand, desc)
 
                 await asyncio.sleep(1)
 
                 if blackjack: #if dealer has blackjack
 
-                    await self.bot.say("**The dealer has a blackjack!**")
+                    await self.say("**The dealer has a blackjack!**")
 
-                    for player in self.players:
-                        if player != self.bot:
-                            for hand in self.players[player]["hand"]:
-                                if self.players[player]["hand"][hand]["blackjack"]:
-                                    self.bot.get_cog('Economy').bank.deposit_credits(player, self.players[player]["hand"][hand]["bet"])
-                                    desc = "{0} ties dealer and pushes!".format(player.name)
+                    bank = self.bot.get_cog('Economy').bank
+                    payouts = bank.transaction()
+                    try:
+                        for player in self.players:
+                            if player != self.bot:
+                                payouts.capture(self.players[player]["hold"], player, self.stake(player))
+                                for hand in self.players[player]["hand"]:
+                                    if self.players[player]["hand"][hand]["blackjack"]:
+                                        payouts.deposit(player, self.players[player]["hand"][hand]["bet"])
+                                        desc = "{0} ties dealer and pushes!".format(player.name)
 
-                                    if self.settings["BLACKJACK_IMAGES_ENABLED"]:
-                                        await self.show_hand(player, curr_hand, ctx.message, desc)
+                                        if self.settings["BLACKJACK_IMAGES_ENABLED"]:
+                                            await self.show_hand(player, curr_hand, desc)
 
-                                else:
-                                    desc = "{0} loses with a score of {1}".format(player.name, str(count))
+                                    else:
+                                        desc = "{0} loses with a score of {1}".format(player.name, str(count))
 
-                                    if self.settings["BLACKJACK_IMAGES_ENABLED"]:
-                                        await self.show_hand(player, curr_hand, ctx.message, desc)
+                                        if self.settings["BLACKJACK_IMAGES_ENABLED"]:
+                                            await self.show_hand(player, curr_hand, desc)
+                    finally:
+                        await bank.offload(payouts.commit) #pay whatever was settled even if a message failed
 
 
                     self.game_state = "pregame"
@@ -423,46 +926,56 @@ class Blackjack:
 
                 elif dealer_count > 21: #if dealer busts
 
-                    await self.bot.say("**The dealer has busted!**")
+                    await self.say("**The dealer has busted!**")
+                    bank = self.bot.get_cog('Economy').bank
+                    payouts = bank.transaction()
                     for player in self.players:
                         if player != self.bot:
+                            payouts.capture(self.players[player]["hold"], player, self.stake(player))
                             for hand in self.players[player]["hand"]:
                                 count = await self.count_hand(player, hand)
                                 if self.players[player]["hand"][hand]["blackjack"]:
-                                    self.bot.get_cog('Economy').bank.deposit_credits(player, self.players[player]["hand"][hand]["bet"] * 2.5)
-                                    desc = "{0} beats dealer with a blackjack and wins **{2}**!".format(player.name, str(count), self.players[player]["hand"][hand]["bet"] * 1.5)
+                                    payouts.deposit(player, self.players[player]["hand"][hand]["bet"] * 5 // 2)
+                                    desc = "{0} beats dealer with a blackjack and wins **{2}**!".format(player.name, str(count), self.players[player]["hand"][hand]["bet"] * 3 // 2)
                                 elif count <= 21:
-                                    self.bot.get_cog('Economy').bank.deposit_credits(player, self.players[player]["hand"][hand]["bet"] * 2)
+                                    payouts.deposit(player, self.players[player]["hand"][hand]["bet"] * 2)
                                     desc = "{0} doesn't bust with a score of {1} and wins **{2}**!".format(player.name, str(count), self.players[player]["hand"][hand]["bet"])
                                 else:
                                     desc = "{0} busted and wins nothing".format(player.name)
+                    await bank.offload(payouts.commit)
 
                     if self.settings["BLACKJACK_IMAGES_ENABLED"]:
-                        await self.show_hand(player, curr_hand, ctx.message, desc)
+                        await self.show_hand(player, curr_hand, desc)
 
                     self.game_state = "pregame"
                     await asyncio.sleep(3)
 
                 elif dealer_count >= 17: #if dealer stands
 
-                    await self.bot.say("**The dealer stands at {0}!**".format(dealer_count))
-                    for player in self.players:
-                        if player != self.bot:
-                            for hand in self.players[player]["hand"]:
-                                count = await self.count_hand(player, hand)
-                                if self.players[player]["hand"][hand]["blackjack"]:
-                                    self.bot.get_cog('Economy').bank.deposit_credits(player, self.players[player]["hand"][hand]["bet"] * 2.5)
-                                    await self.bot.say("{0} beats dealer with a blackjack and wins **{2}**!".format(player.name, str(count), self.players[player]["hand"][hand]["bet"] * 1.5))
-                                elif count > 21:
-                                    await self.bot.say("{0} busted and wins nothing".format(player.name))
-                                elif count > dealer_count:
-                                    self.bot.get_cog('Economy').bank.deposit_credits(player, self.players[player]["hand"][hand]["bet"] * 2)
-                                    await self.bot.say("{0} beats dealer with a score of {1} and wins **{2}**!".format(player.name, str(count), self.players[player]["hand"][hand]["bet"]))
-                                elif count == dealer_count:
-                                    self.bot.get_cog('Economy').bank.deposit_credits(player, self.players[player]["hand"][hand]["bet"])
-                                    await self.bot.say("{0} ties dealer and pushes!".format(player.name))
-                                else:
-                                    await self.bot.say("{0} loses with a score of {1}".format(player.name, str(count)))
+                    await self.say("**The dealer stands at {0}!**".format(dealer_count))
+                    bank = self.bot.get_cog('Economy').bank
+                    payouts = bank.transaction()
+                    try:
+                        for player in self.players:
+                            if player != self.bot:
+                                payouts.capture(self.players[player]["hold"], player, self.stake(player))
+                                for hand in self.players[player]["hand"]:
+                                    count = await self.count_hand(player, hand)
+                                    if self.players[player]["hand"][hand]["blackjack"]:
+                                        payouts.deposit(player, self.players[player]["hand"][hand]["bet"] * 5 // 2)
+                                        await self.say("{0} beats dealer with a blackjack and wins **{2}**!".format(player.name, str(count), self.players[player]["hand"][hand]["bet"] * 3 // 2))
+                                    elif count > 21:
+                                        await self.say("{0} busted and wins nothing".format(player.name))
+                                    elif count > dealer_count:
+                                        payouts.deposit(player, self.players[player]["hand"][hand]["bet"] * 2)
+                                        await self.say("{0} beats dealer with a score of {1} and wins **{2}**!".format(player.name, str(count), self.players[player]["hand"][hand]["bet"]))
+                                    elif count == dealer_count:
+                                        payouts.deposit(player, self.players[player]["hand"][hand]["bet"])
+                                        await self.say("{0} ties dealer and pushes!".format(player.name))
+                                    else:
+                                        await self.say("{0} loses with a score of {1}".format(player.name, str(count)))
+                    finally:
+                        await bank.offload(payouts.commit) #pay whatever was settled even if a message failed
 
                     self.game_state = "pregame"
                     await asyncio.sleep(3)
@@ -472,32 +985,24 @@ class Blackjack:
                         if player != self.bot:
                             em = discord.Embed(title = '', description = '', colour= 0x95270e)
                             em.set_author(name = player.name, icon_url = player.avatar_url)
-                            em.add_field(name = 'Current Balance', value = '{0}'.format(self.bot.get_cog('Economy').bank.get_balance(player)))
-                            await self.bot.send_message(ctx.message.channel, embed = em)
-                            #await self.bot.say("{0} now has a balance of: {1}".format(player.name, self.bot.get_cog('Economy').bank.get_balance(player)))
+                            bank = self.bot.get_cog('Economy').bank
+                            em.add_field(name = 'Current Balance', value = '{0}'.format(await bank.offload(bank.get_balance, player)))
+                            await self.bot.send_message(self.channel, embed = em)
+                            #await self.say("{0} now has a balance of: {1}".format(player.name, self.bot.get_cog('Economy').bank.get_balance(player)))
 
     async def draw_card(self, player):
-        suit = randint(1, 4)
-        num = randint(1, 13)
-
-        if suit == 1:
-            suit = "hearts"
-        elif suit == 2:
-            suit = "diamonds"
-        elif suit == 3:
-            suit = "clubs"
-        elif suit == 4:
-            suit = "spades"
-
-        rank = self.deck[suit][num]["rank"]
+        card = self.shoe.draw()
+        suit = CARD_SUITS[card]
+        rank = CARD_RANKS[card]
 
         curr_hand = self.players[player]["curr_hand"]
         card_index = len(self.players[player]["hand"][curr_hand]["card"])
 
         self.players[player]["hand"][curr_hand]["card"][card_index] = {}
+        self.players[player]["hand"][curr_hand]["card"][card_index]["id"] = card
         self.players[player]["hand"][curr_hand]["card"][card_index]["suit"] = suit
         self.players[player]["hand"][curr_hand]["card"][card_index]["rank"] = rank
-        self.players[player]["hand"][curr_hand]["card"][card_index]["value"] = self.deck[suit][num]["value"]
+        self.players[player]["hand"][curr_hand]["card"][card_index]["value"] = CARD_VALUES[card]
         self.players[player]["hand"][curr_hand]["ranks"].append(rank)
 
         await self.count_hand(player, curr_hand) #to change ace names and values in the "ranks" table, don't actually need the count
@@ -528,134 +1033,29 @@ class Blackjack:
                     break
         return count
 
-    async def show_hand(self, player, curr_hand, message, desc: str=None, firstDeal: bool=None):
+    async def show_hand(self, player, curr_hand, desc: str=None, firstDeal: bool=None):
+        data = await self.render_hand(player, curr_hand)
+        await self.send_hand(player, desc, data)
+
+    async def render_hand(self, player, curr_hand):
         cards = self.players[player]["hand"][curr_hand]["card"]
-        box1 = (0,0,56,82)
-        box2 = (0,0,112,82)
-        count = 0
 
-        cRank = ""
-        cSuit = ""
+        names = [CARD_SPRITES[cards[card]["id"]] for card in cards]
 
-        hand = Image.open("data/blackjack/hand/{}_cards.png".format(len(cards)))
-        for card in cards:
-            cRank = cards[card]["rank"]
-            if cRank == "small_ace":
-                cRank = "ace"
-            cSuit = cards[card]["suit"]
-            crd = Image.open("data/blackjack/playing_cards/{}_of_{}.png".format(cRank,cSuit))
-            if len(cards) is 1:
-                hand.paste(crd, (56,0,112,82))
-            else:
-                hand.paste(crd, (56*count,0,(56*count)+56,82))
-            count += 1
-            if player is self.bot:
-                hand.save("data/blackjack/hand/{}_hand.png".format("dealer"))
-            else:
-                hand.save("data/blackjack/hand/{}_hand.png".format(player.name))
-            crd.close()
-        hand.close()
+        data = self.cog.hand_cache.get(names)
+        if data is None:
+            data = await self.cog.workers.run(self.cog.atlas.render, names)
+            self.cog.hand_cache.put(names, data)
+        return data
 
+    async def send_hand(self, player, desc, data):
         if player is self.bot:
-            pic = self.imgur_client.upload_from_path("data/blackjack/hand/{}_hand.png".format("dealer"))
             em = discord.Embed(title=' ', description=desc, colour=0x002e20 )
-            link = pic['link']
-            new_link = link[0:8] + ('w' * 3) + link[9:len(link)]
-            em.set_image(url=new_link)
             em.set_author(name='The Dealer')
-            await self.bot.send_message(message.channel, embed=em)
         else:
-            pic = self.imgur_client.upload_from_path("data/blackjack/hand/{}_hand.png".format(player.name))
             em = discord.Embed(title=' ', description=desc, colour=0x95270e)
-            link = pic['link']
-            new_link = link[0:8] + ('w' * 3) + link[9:len(link)]
-            em.set_image(url=new_link)
             em.set_author(name='{}'.format(player.name), icon_url=player.avatar_url)
-            await self.bot.send_message(message.channel, embed=em)
-
-    # async def delete_messages(self, ctx):
-    #     server = ctx.message.server
-    #     user = ctx.message.server.me
-    #     message = ctx.message
-    #     if x.author.id == user.id:
-    #         await self.bot.delete_message(x)
-    #     await self.bot.delete_message(cmdmsg)
-
-
-    @commands.group(pass_context=True, no_pm=True)
-    @checks.admin_or_permissions(manage_server=True)
-    async def blackjackset(self, ctx):
-        """Changes blackjack settings"""
-        if ctx.invoked_subcommand is None:
-            msg = "```"
-            for k, v in self.settings.items():
-                msg += str(k) + ": " + str(v) + "\n"
-            msg += "\nType {}help blackjackset to see the list of commands.```".format(ctx.prefix)
-            await self.bot.say(msg)
-
-
-    @blackjackset.command()
-    async def blackjackmin(self, bet : int):
-        """Minimum blackjack bet"""
-        self.settings["BLACKJACK_MIN"] = bet
-        await self.bot.say("Minimum bet is now " + str(bet) + " credits.")
-        dataIO.save_json(self.sttg_file_path, self.settings)
-
-    @blackjackset.command()
-    async def blackjackmax(self, bet : int):
-        """Maximum blackjack bet"""
-        self.settings["BLACKJACK_MAX"] = bet
-        await self.bot.say("Maximum bet is now " + str(bet) + " credits.")
-        dataIO.save_json(self.sttg_file_path, self.settings)
-
-    @blackjackset.command()
-    async def blackjackmaxtoggle(self):
-        """Toggle the use of a maximum blackjack bet"""
-        self.settings["BLACKJACK_MAX_ENABLED"] = not self.settings["BLACKJACK_MAX_ENABLED"]
-        if self.settings["BLACKJACK_MAX_ENABLED"]:
-            await self.bot.say("Maximum bet is now enabled.")
-        else:
-            await self.bot.say("Maximum bet is now disabled.")
-        dataIO.save_json(self.sttg_file_path, self.settings)
-
-    @blackjackset.command()
-    async def blackjackpretime(self, time : int):
-        """Set the pregame time for players to bet"""
-        self.settings["BLACKJACK_PRE_GAME_TIME"] = time
-        await self.bot.say("Blackjack pre-game time is now " + str(time))
-        dataIO.save_json(self.sttg_file_path, self.settings)
-
-    @blackjackset.command()
-    async def blackjacktime(self, time : int):
-        """Set the maximum game time given to hit"""
-        self.settings["BLACKJACK_GAME_TIME"] = time
-        await self.bot.say("Blackjack maximum game time is now " + str(time))
-        dataIO.save_json(self.sttg_file_path, self.settings)
-
-    @blackjackset.command()
-    async def blackjackimagestoggle(self):
-        """Toggle the use of card images"""
-        self.settings["BLACKJACK_IMAGES_ENABLED"] = not self.settings["BLACKJACK_IMAGES_ENABLED"]
-        if self.settings["BLACKJACK_IMAGES_ENABLED"]:
-            await self.bot.say("Card images are now enabled.")
-        else:
-            await self.bot.say("Card images are now disabled.")
-        dataIO.save_json(self.sttg_file_path, self.settings)
-
-    @blackjackset.command()
-    async def paydaytime(self, seconds : int):
-        """Seconds between each payday"""
-        self.settings["PAYDAY_TIME"] = seconds
-        await self.bot.say("Value modified. At least " + str(seconds) + " seconds must pass between each payday.")
-        dataIO.save_json(self.sttg_file_path, self.settings)
-
-    @blackjackset.command()
-    async def paydaycredits(self, credits : int):
-        """Credits earned each payday"""
-        self.settings["PAYDAY_CREDITS"] = credits
-        await self.bot.say("Every payday will now give " + str(credits) + " credits.")
-
-
+        await self.cog.image_host.send(self.bot, self.channel, em, data)
 
 def check_folders():
     if not os.path.exists("data/blackjack"):
@@ -669,7 +1069,13 @@ def check_files():
         "BLACKJACK_MAX_ENABLED" : False,
         "BLACKJACK_GAME_TIME" : 60,
         "BLACKJACK_PRE_GAME_TIME" : 10,
-        "BLACKJACK_IMAGES_ENABLED" : True
+        "BLACKJACK_IMAGES_ENABLED" : True,
+        "BLACKJACK_DECKS" : DEFAULT_DECKS,
+        "BLACKJACK_PENETRATION" : DEFAULT_PENETRATION,
+        "BLACKJACK_CACHE_KB" : DEFAULT_CACHE_KB,
+        "BLACKJACK_IMAGE_HOST" : "attachment",
+        "BLACKJACK_WORKERS" : DEFAULT_WORKERS,
+        "SERVERS" : {}
     }
 
     f = "data/blackjack/settings.json"
@@ -0,0 +1,73 @@
+"""Runs the casinobank Bank as a service shared by several bot processes.
+
+Run it from the root of a Red install so cogs.utils is importable:
+
+    python path/to/casinobank/bankd.py --address unix:data/economy/bank.sock
+
+It serves the bank configured in data/economy/storage.json. Then point
+every bot process at it with `[p]economyset service <address>`. All of
+them share one set of balances, and only this process touches the bank's
+files.
+"""
+
+import argparse
+import asyncio
+import importlib.util
+import json
+import os
+import signal
+import sys
+
+DEFAULT_ADDRESS = "unix:data/economy/bank.sock"
+
+
+async def send_cmd_help(ctx):  # The cog imports this from __main__
+    pass
+
+
+def load_cog(path):
+    sys.path.insert(0, os.getcwd())
+    import cogs.utils  # noqa: F401 -- the cog's relative imports resolve against it
+    spec = importlib.util.spec_from_file_location("cogs.casinobank", path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the casinobank bank to other processes")
+    parser.add_argument("--address", default=DEFAULT_ADDRESS, help="unix:<path> or tcp:<host>:<port>, host being a loopback address")
+    parser.add_argument("--storage", default="data/economy/storage.json")
+    parser.add_argument("--cog", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "casinobank.py"))
+    args = parser.parse_args()
+
+    cog = load_cog(args.cog)
+    try:
+        cog.parse_address(args.address)
+    except ValueError as e:
+        parser.error(str(e))
+    cog.check_folders()
+    cog.check_files()
+    storage = dict(cog.default_storage)
+    with open(args.storage, encoding="utf-8") as f:
+        storage.update(json.load(f))
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    task = loop.create_task(cog.serve_bank(storage, args.address))
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, task.cancel)
+    print("Serving the bank on {}".format(args.address))
+    try:
+        loop.run_until_complete(task)
+    except asyncio.CancelledError:
+        pass
+    finally:
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.remove_signal_handler(sig)
+        loop.close()
+
+
+if __name__ == "__main__":
+    main()
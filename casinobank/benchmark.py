@@ -0,0 +1,217 @@
+"""Scaling benchmark for the casinobank Bank.
+
+Run it from the root of a Red install so cogs.utils is importable:
+
+    python path/to/casinobank/benchmark.py --accounts 10000 100000 1000000
+
+Every (backend, account count) pair runs in its own process against fake
+servers and members, so peak memory is measured per scenario. Results are
+printed as JSON (or written to --output) with throughput, p50/p99 latency in
+microseconds and peak RSS in KiB for every operation.
+"""
+
+import argparse
+import asyncio
+import importlib.util
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+BACKENDS = ("json", "journal", "binary", "writebehind", "sharded", "columnar", "sqlite")
+
+
+async def send_cmd_help(ctx):  # The cog imports this from __main__
+    pass
+
+
+class FakeServer:
+    def __init__(self, id):
+        self.id = id
+        self.name = "server{}".format(id)
+        self.members = {}
+
+    def get_member(self, user_id):
+        return self.members.get(user_id)
+
+
+class FakeMember:
+    def __init__(self, id, server):
+        self.id = id
+        self.name = "user{}".format(id)
+        self.server = server
+        server.members[id] = self
+
+
+class FakeBot:
+    def __init__(self, servers):
+        self.servers = {server.id: server for server in servers}
+        self.loop = asyncio.new_event_loop()
+
+    def get_server(self, server_id):
+        return self.servers.get(server_id)
+
+
+def load_cog(path):
+    sys.path.insert(0, os.getcwd())
+    import cogs.utils  # noqa: F401 -- the cog's relative imports resolve against it
+    spec = importlib.util.spec_from_file_location("cogs.casinobank", path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def open_bank(cog, backend, bot, directory):
+    if backend == "sqlite":
+        return cog.SQLiteBank(bot, os.path.join(directory, "bank.db"))
+    if backend == "sharded":
+        return cog.ShardedBank(bot, os.path.join(directory, "bank"), write_behind=True)
+    if backend == "columnar":
+        return cog.ColumnarBank(bot, os.path.join(directory, "bank.bin"), write_behind=True)
+    if backend == "binary":
+        return cog.Bank(bot, os.path.join(directory, "bank.bin"), journal=True)
+    return cog.Bank(bot, os.path.join(directory, "bank.json"),
+                    journal=backend == "journal", write_behind=backend == "writebehind")
+
+
+def summarize(samples):
+    samples = sorted(samples)
+    total = sum(samples)
+    return {"count" : len(samples),
+            "ops_per_sec" : round(len(samples) / total, 1) if total else None,
+            "p50_us" : round(samples[len(samples) // 2] * 1e6, 1),
+            "p99_us" : round(samples[min(len(samples) - 1, int(len(samples) * 0.99))] * 1e6, 1)}
+
+
+def timed(samples, function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    samples.append(time.perf_counter() - start)
+    return result
+
+
+def run_scenario(cog_path, backend, count, per_server, ops, seed):
+    cog = load_cog(cog_path)
+    rng = random.Random(seed)
+    servers = [FakeServer(str(i)) for i in range(max(1, -(-count // per_server)))]
+    members = [FakeMember(str(100000000 + i), servers[i % len(servers)]) for i in range(count)]
+    by_server = [list(server.members.values()) for server in servers]
+    bot = FakeBot(servers)
+    results = {}
+
+    with tempfile.TemporaryDirectory() as directory:
+        with open(os.path.join(directory, "bank.json"), "w") as f:
+            f.write("{}")
+        bank = open_bank(cog, backend, bot, directory)
+        now = int(time.time())
+        samples = []
+        timed(samples, bank.load_accounts,
+              (cog.Account(m.id, m.server.id, m.name, rng.randint(1000, 100000), now) for m in members))
+        results["populate"] = summarize(samples)
+
+        samples = []
+        for i in range(ops):
+            timed(samples, bank.create_account, FakeMember(str(900000000 + i), rng.choice(servers)))
+        results["create_account"] = summarize(samples)
+
+        samples = []
+        for i in range(ops):
+            timed(samples, bank.deposit_credits, rng.choice(members), 10)
+        results["deposit_credits"] = summarize(samples)
+
+        samples = []
+        for i in range(ops):
+            sender, receiver = rng.sample(rng.choice(by_server), 2)
+            timed(samples, bank.transfer_credits, sender, receiver, 1)
+        results["transfer_credits"] = summarize(samples)
+
+        repeats = max(1, ops // 100)
+        for name, function, args in (("get_server_accounts", bank.get_server_accounts, (servers[0],)),
+                                     ("get_all_accounts", bank.get_all_accounts, ()),
+                                     ("server_leaderboard", bank.get_leaderboard, (servers[0], 10)),
+                                     ("global_leaderboard", bank.get_leaderboard, (None, 10))):
+            samples = []
+            for i in range(repeats):
+                timed(samples, function, *args)
+            results[name] = summarize(samples)
+
+        samples = []
+        for i in range(ops):
+            timed(samples, bank.get_rank, rng.choice(members))
+        results["get_rank"] = summarize(samples)
+
+        samples = []
+        if backend in ("writebehind", "columnar"):
+            bank.dirty = True
+            timed(samples, bot.loop.run_until_complete, bank.flush())
+        elif backend == "sharded":
+            for shard in bank.shards.values():
+                shard.dirty = True
+            timed(samples, bot.loop.run_until_complete, bank.flush())
+        elif backend == "sqlite":
+            timed(samples, bank.conn.execute, "PRAGMA wal_checkpoint(TRUNCATE)")
+        else:
+            timed(samples, bank.compact)
+        results["save"] = summarize(samples)
+        bank.close()
+
+        samples = []
+        timed(samples, open_bank, cog, backend, bot, directory).close()
+        results["load"] = summarize(samples)
+
+    return {"backend" : backend,
+            "accounts" : count,
+            "servers" : len(servers),
+            "peak_rss_kb" : resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            "operations" : results}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark casinobank storage at scale")
+    parser.add_argument("--accounts", type=int, nargs="+", default=[10000, 100000, 1000000])
+    parser.add_argument("--backends", nargs="+", choices=BACKENDS, default=list(BACKENDS))
+    parser.add_argument("--per-server", type=int, default=10000, help="accounts per fake server")
+    parser.add_argument("--ops", type=int, default=1000, help="timed calls per operation")
+    parser.add_argument("--sync-ops", type=int, default=20,
+                        help="timed calls per operation for the json backend, which rewrites the file every call")
+    parser.add_argument("--seed", type=int, default=26)
+    parser.add_argument("--cog", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "casinobank.py"))
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    parser.add_argument("--scenario", nargs=2, metavar=("BACKEND", "ACCOUNTS"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.scenario:
+        backend, count = args.scenario[0], int(args.scenario[1])
+        print(json.dumps(run_scenario(args.cog, backend, count, args.per_server, args.ops, args.seed)))
+        return
+
+    report = {"python" : platform.python_version(),
+              "platform" : platform.platform(),
+              "ops" : args.ops,
+              "results" : []}
+    for count in args.accounts:
+        for backend in args.backends:
+            print("Running {} with {} accounts...".format(backend, count), file=sys.stderr)
+            output = subprocess.check_output([sys.executable, os.path.abspath(__file__),
+                                              "--scenario", backend, str(count),
+                                              "--per-server", str(args.per_server),
+                                              "--ops", str(args.sync_ops if backend == "json" else args.ops),
+                                              "--seed", str(args.seed),
+                                              "--cog", args.cog])
+            report["results"].append(json.loads(output.decode("utf-8")))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=4)
+    else:
+        print(json.dumps(report, indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,18 +1,335 @@
 import discord
 from discord.ext import commands
 from cogs.utils.dataIO import dataIO
-from collections import namedtuple, defaultdict
+from collections import defaultdict
 from datetime import datetime
 from random import randint
-from copy import deepcopy
 from .utils import checks
 from __main__ import send_cmd_help
 import os
 import time
+import math
 import logging
+import logging.handlers
 import io
+import json
+import asyncio
+import atexit
+import threading
+import sqlite3
+import socket
+import ipaddress
+import struct
+import re
+import operator
+import csv
+import statistics
+import sys
+from array import array
+from bisect import bisect_left, insort
+from heapq import heappush, heappop, nsmallest, nlargest
+from itertools import islice, compress
+from itertools import accumulate
+from functools import wraps, partial
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 default_settings = {"PAYDAY_TIME" : 86400, "PAYDAY_CREDITS" : 500}
+default_storage = {"BACKEND" : "json", "JOURNAL" : False, "JOURNAL_FSYNC" : False,
+                   "COMPACT_INTERVAL" : 300, "WRITE_BEHIND" : False, "FLUSH_INTERVAL" : 5,
+                   "SHARD_IDLE" : 1800, "SNAPSHOT" : "binary", "SERVICE" : None,
+                   "LEDGER" : True}
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+LOG_FILE_PATH = "data/economy/economy.log"
+LOG_MAX_BYTES = 4 * 1024 * 1024
+LOG_BACKUPS = 5
+EXPORT_DIR = "data/economy/exports"
+EXPORT_FIELDS = ("server_id", "user_id", "name", "balance", "created_at")
+EXPORT_MEMBER_FIELDS = ("server_name", "member_name", "is_member")
+EXPORT_CHUNK = 1000  # Accounts written between yields to the event loop
+COOLDOWN_SAVE_INTERVAL = 60
+BALANCE_COMPARISONS = {"<" : operator.lt, "<=" : operator.le, ">" : operator.gt,
+                       ">=" : operator.ge, "=" : operator.eq}
+LEDGER_PATH = "data/economy/ledger"
+HISTORY_PAGE_SIZE = 10
+HOLDS_PATH = "data/economy/holds.json"
+MAX_BALANCE = 2 ** 63 - 1  # Largest balance snapshots, columns and the ledger can hold
+SERVICE_TIMEOUT = 10  # Seconds to wait for the bank service to connect or reply
+LEDGER_RECORD = struct.Struct("<qIBqqq")  # time, account key, op, change, balance after, previous record
+LEDGER_INDEX_HEADER = struct.Struct("<qq")  # records covered, keys covered
+LEDGER_OPS = ("create", "deposit", "withdraw", "set", "transfer_in", "transfer_out", "bulk", "capture", "checkpoint", "wipe")
+SNAPSHOT_MAGIC = b"CBNK"
+SNAPSHOT_VERSION = 1
+SNAPSHOT_BIG_ENDIAN = 1
+SNAPSHOT_HEADER = struct.Struct("<4sHHIIII")  # magic, version, flags, id table, accounts, name table, legacy
+SNAPSHOT_COLUMNS = ("I", "I", "q", "q", "I")  # server, user, balance, created, name offset
+
+
+class ActivityFormatter(logging.Formatter):
+    """Writes each log record as one JSON object per line"""
+
+    fields = ("op", "server", "user", "target", "amount")
+
+    def format(self, record):
+        entry = {"time" : int(record.created), "msg" : record.getMessage()}
+        for field in self.fields:
+            if hasattr(record, field):
+                entry[field] = getattr(record, field)
+        return json.dumps(entry, separators=(",", ":"))
+
+
+def read_backwards(file_path, block_size=8192):
+    """Yields the lines of a file from last to first, reading blocks from the end"""
+    with open(file_path, "rb") as f:
+        position = f.seek(0, os.SEEK_END)
+        remainder = b""
+        while position > 0:
+            size = min(block_size, position)
+            position -= size
+            f.seek(position)
+            lines = (f.read(size) + remainder).split(b"\n")
+            remainder = lines.pop(0)
+            for line in reversed(lines):
+                if line:
+                    yield line
+        if remainder:
+            yield remainder
+
+
+_activity_indexes = {}  # (device, inode, size) of a rotated log -> {("user" or "op", value): line offsets}
+
+
+def index_activity(file_path):
+    """Maps ("user", id) and ("op", name) to the offsets of the lines that mention them"""
+    index = defaultdict(lambda: array("q"))
+    with open(file_path, "rb") as f:
+        offset = 0
+        for line in f:
+            try:
+                entry = json.loads(line.decode("utf-8", "replace"))
+            except ValueError:  # Plain text line from before the log was structured
+                entry = {}
+            for user_id in {entry.get("user"), entry.get("target")} - {None}:
+                index[("user", user_id)].append(offset)
+            if "op" in entry:
+                index[("op", entry["op"])].append(offset)
+            offset += len(line)
+    return dict(index)
+
+
+def log_file_key(file_path):
+    stat = os.stat(file_path)
+    return stat.st_dev, stat.st_ino, stat.st_size
+
+
+def read_indexed(file_path, keys):
+    """Yields the lines listed under every one of keys in the file's index, last to first
+
+    Rotated logs don't change until they're deleted, so each is indexed
+    once and found again by its inode after being renamed."""
+    file_key = log_file_key(file_path)
+    index = _activity_indexes.get(file_key)
+    if index is None:
+        index = _activity_indexes[file_key] = index_activity(file_path)
+    offsets = set(index.get(keys[0], ()))
+    for key in keys[1:]:
+        offsets.intersection_update(index.get(key, ()))
+    with open(file_path, "rb") as f:
+        for offset in sorted(offsets, reverse=True):
+            f.seek(offset)
+            yield f.readline().rstrip(b"\n")
+
+
+def recent_activity(num, *, user_id=None, op=None):
+    """Newest-first activity entries, walking back through rotated logs only
+    as far as needed to find num matches
+
+    Filtered lookups read rotated logs through an index of their lines, so
+    rare matches don't mean reading every log in full."""
+    needles = []
+    keys = []
+    if user_id is not None:
+        needles.append('"{}"'.format(user_id).encode("utf-8"))
+        keys.append(("user", user_id))
+    if op is not None:
+        needles.append('"op":"{}"'.format(op).encode("utf-8"))
+        keys.append(("op", op))
+    entries = []
+    paths = [LOG_FILE_PATH] + ["{}.{}".format(LOG_FILE_PATH, i) for i in range(1, LOG_BACKUPS + 1)]
+    rotated = {log_file_key(path) for path in paths[1:] if os.path.exists(path)}
+    for file_key in set(_activity_indexes) - rotated:  # Its log has been rotated away
+        _activity_indexes.pop(file_key, None)
+    for path in paths:
+        if not os.path.exists(path):
+            break
+        lines = read_indexed(path, keys) if keys and path != LOG_FILE_PATH else read_backwards(path)
+        for line in lines:
+            if not all(needle in line for needle in needles):
+                continue
+            line = line.decode("utf-8", "replace").rstrip("\r")
+            try:
+                entry = json.loads(line)
+            except ValueError:  # Plain text line from before the log was structured
+                if needles:
+                    continue
+                entry = {"time" : None, "msg" : line}
+            if user_id is not None and user_id not in (entry.get("user"), entry.get("target")):
+                continue
+            if op is not None and entry.get("op") != op:
+                continue
+            entries.append(entry)
+            if len(entries) >= num:
+                return entries
+    return entries
+
+
+class CooldownRegistry:
+    """Remembers when users last used a command, until their cooldown ends.
+
+    duration(server_id) gives the current cooldown of a server, so changing
+    it applies to users already waiting. Each server keeps its users in a
+    heap by last use, which is also expiry order for one duration, and
+    expired ones are swept as they pass, so memory follows the users still
+    on cooldown. Times are wall-clock and the registry is saved to disk, so
+    cooldowns survive restarts."""
+
+    def __init__(self, file_path, duration):
+        self.file_path = file_path
+        self.duration = duration
+        self.dirty = False
+        self._entries = {}  # (server id, user id) -> last use
+        self._heaps = {}  # server id -> heap of (last use, user id)
+        if dataIO.is_valid_json(file_path):
+            for server_id, users in dataIO.load_json(file_path).items():
+                for user_id, (last, expires) in users.items():
+                    self._set(server_id, user_id, last)
+        self.sweep()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def remaining(self, server_id, user_id):
+        """Seconds left before user can use the command again, rounded up"""
+        last = self._entries.get((server_id, user_id))
+        if last is None:
+            return 0
+        return max(0, math.ceil(last + self.duration(server_id) - time.time()))
+
+    def touch(self, server_id, user_id):
+        now = time.time()
+        self.sweep(now)
+        self._set(server_id, user_id, now)
+        self.dirty = True
+
+    def sweep(self, now=None):
+        if now is None:
+            now = time.time()
+        for server_id, heap in list(self._heaps.items()):
+            cutoff = now - self.duration(server_id)
+            while heap and heap[0][0] <= cutoff:
+                last, user_id = heappop(heap)
+                if self._entries.get((server_id, user_id)) == last:  # Not renewed since
+                    del self._entries[(server_id, user_id)]
+                    self.dirty = True
+            if not heap:
+                del self._heaps[server_id]
+
+    def save(self):
+        self.sweep()
+        data = {}
+        for (server_id, user_id), last in self._entries.items():
+            data.setdefault(server_id, {})[user_id] = (last, last + self.duration(server_id))
+        dataIO.save_json(self.file_path, data)
+        self.dirty = False
+
+    def _set(self, server_id, user_id, last):
+        self._entries[(server_id, user_id)] = last
+        heappush(self._heaps.setdefault(server_id, []), (last, user_id))
+
+
+class Hold:
+    __slots__ = ("id", "user", "amount", "tag", "created")
+
+    def __init__(self, id, user, amount, tag, created):
+        self.id = id
+        self.user = user
+        self.amount = amount
+        self.tag = tag
+        self.created = created
+
+    def to_json(self):
+        return {"server" : self.user.server.id, "user" : self.user.id,
+                "amount" : self.amount, "tag" : self.tag, "created" : self.created}
+
+
+class HoldRegistry:
+    """Credits set aside for games in progress.
+
+    Holds only live in memory and the bank is written once, when a hold is
+    captured. Held credits stay in the account until then, so nothing is lost
+    if the bot stops mid-game: holds saved by a previous run are released on
+    load and listed in recovered."""
+
+    def __init__(self, file_path=None):
+        self.file_path = file_path
+        self.dirty = False
+        self.holds = {}
+        self.recovered = []
+        self._totals = defaultdict(int)  # (server id, user id) -> credits held
+        self._next_id = int(time.time() * 1000)  # Ids from before a restart never come back
+        if file_path is not None and dataIO.is_valid_json(file_path):
+            self.recovered = list(dataIO.load_json(file_path).values())
+            self.dirty = bool(self.recovered)
+
+    def __len__(self):
+        return len(self.holds)
+
+    def __contains__(self, hold_id):
+        return hold_id in self.holds
+
+    def get(self, hold_id):
+        try:
+            return self.holds[hold_id]
+        except KeyError:
+            raise UnknownHold()
+
+    def held(self, server_id, user_id):
+        return self._totals.get((server_id, user_id), 0)
+
+    def add(self, user, amount, tag):
+        hold = Hold(self._next_id, user, amount, tag, int(time.time()))
+        self._next_id += 1
+        self.restore(hold)
+        return hold
+
+    def resize(self, hold_id, amount):
+        hold = self.get(hold_id)
+        self._totals[(hold.user.server.id, hold.user.id)] += amount - hold.amount
+        hold.amount = amount
+        self.dirty = True
+
+    def pop(self, hold_id):
+        hold = self.get(hold_id)
+        del self.holds[hold_id]
+        key = (hold.user.server.id, hold.user.id)
+        self._totals[key] -= hold.amount
+        if not self._totals[key]:
+            del self._totals[key]
+        self.dirty = True
+        return hold
+
+    def restore(self, hold):
+        self.holds[hold.id] = hold
+        self._totals[(hold.user.server.id, hold.user.id)] += hold.amount
+        self.dirty = True
+
+    def save(self):
+        if self.file_path is not None:
+            dataIO.save_json(self.file_path, {str(hold_id): hold.to_json() for hold_id, hold in self.holds.items()})
+        self.dirty = False
 
 
 class BankError(Exception):
@@ -39,30 +356,776 @@ class SameSenderAndReceiver(BankError):
     pass
 
 
-class Bank:
-    def __init__(self, bot, file_path):
-        self.accounts = dataIO.load_json(file_path)
+class UnknownHold(BankError):
+    pass
+
+
+class ServiceUnavailable(BankError):
+    pass
+
+
+class BalanceTooLarge(BankError):
+    pass
+
+
+class BankJournal:
+    """Append-only log of account writes.
+
+    Every record holds the full state of the account it touches, so replaying
+    the log on top of any older snapshot is idempotent."""
+
+    def __init__(self, file_path, *, fsync=False):
+        self.file_path = file_path
+        self.fsync = fsync
+        self.size = 0
+        self._file = None
+
+    def replay(self):
+        """Yields every intact record, then opens the journal for appending"""
+        good = 0
+        if os.path.exists(self.file_path):
+            with open(self.file_path, "rb") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line.decode("utf-8"))
+                    except ValueError:
+                        break  # Torn write from a crash, everything before it is intact
+                    if record["op"] == "batch":
+                        yield from record["records"]
+                    else:
+                        yield record
+                    good += len(line)
+        self._open(good)
+
+    def append(self, records):
+        if len(records) > 1:  # One line, so a crash can't leave half of a transaction behind
+            records = [{"op" : "batch", "records" : records}]
+        data = "".join(json.dumps(r, separators=(",", ":")) + "\n" for r in records)
+        data = data.encode("utf-8")
+        self._file.write(data)
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+        self.size += len(data)
+
+    def truncate(self):
+        self._file.seek(0)
+        self._file.truncate()
+        self.size = 0
+
+    def discard(self, size):
+        """Drops the first size bytes of records, keeping anything written after them"""
+        if size >= self.size:
+            self.truncate()
+            return
+        with open(self.file_path, "rb") as f:
+            f.seek(size)
+            data = f.read(self.size - size)
+        temp_path = self.file_path + ".tmp"
+        with open(temp_path, "wb") as f:
+            f.write(data)
+            if self.fsync:
+                os.fsync(f.fileno())
+        self.close()
+        os.replace(temp_path, self.file_path)
+        self._open(len(data))
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _open(self, size):
+        self.close()
+        self._file = open(self.file_path, "ab")
+        self._file.truncate(size)  # Drop a torn tail so new records don't land behind it
+        self.size = size
+
+
+class BankLedger:
+    """Append-only record of every balance change, kept per account.
+
+    <path>.bin holds fixed-size records (time, account, op, change, balance
+    after, previous record of the account) and <path>.keys lists the
+    accounts they point to, one per line. Only the last record and the
+    record count of each account are kept in memory; <path>.idx saves them
+    with the number of records they cover, so opening the ledger only reads
+    the records written since. The first page of history follows the
+    previous record links; later pages use the list of record numbers of
+    the account, built by one walk down its links the first time it's
+    paged through and kept up to date after that.
+
+    Balances changed while the ledger wasn't recording, such as when it was
+    turned off or accounts were copied into another backend, are written
+    down with checkpoint records, so the ledger always ends with the balance
+    the bank had."""
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.keys = []
+        self._key_index = {}
+        self.last = array("q")  # Key position -> number of its newest record
+        self.counts = array("q")  # Key position -> number of records
+        self.numbers = {}  # Key position -> numbers of its records, oldest first, once paged through
+        self.dirty = False
+        self._lock = threading.Lock()
+        self._records_path = file_path + ".bin"
+        self._keys_path = file_path + ".keys"
+        self._index_path = file_path + ".idx"
+        self._open()
+
+    def __len__(self):
+        return self._count
+
+    def prepare(self, entries):
+        """Checks (op, account, change) entries before the bank stores them
+
+        Returns the records for write(). Raises BankError for a change or
+        balance a record can't hold, so nothing is stored that the ledger
+        would then miss."""
+        records = []
+        for op, account, change in entries:
+            try:
+                LEDGER_RECORD.pack(0, 0, LEDGER_OPS.index(op), change, account.balance, -1)
+            except struct.error:
+                raise BankError("{} can't be recorded in the ledger".format(account.balance))
+            records.append(((account.server_id, account.id), LEDGER_OPS.index(op), change, account.balance))
+        return records
+
+    def write(self, records):
+        """Appends records returned by prepare()"""
+        now = int(time.time())
+        new_keys = []
+        data = bytearray()
+        with self._lock:
+            for key, op, change, balance in records:
+                position = self._key_index.get(key)
+                if position is None:
+                    position = self._add_key(key)
+                    new_keys.append("{} {}\n".format(*key))
+                data += LEDGER_RECORD.pack(now, position, op, change, balance, self.last[position])
+                if position in self.numbers:
+                    self.numbers[position].append(self._count)
+                self.last[position] = self._count
+                self.counts[position] += 1
+                self._count += 1
+            if new_keys:  # Keys go first so a record never points past the end of the key list
+                self._keys_file.write("".join(new_keys).encode("utf-8"))
+                self._keys_file.flush()
+            self._records_file.write(data)
+            self._records_file.flush()
+            self.dirty = True
+
+    def append(self, entries):
+        """Records (op, account, change) entries, where account holds the new balance"""
+        self.write(self.prepare(entries))
+
+    def history(self, server_id, user_id, page=1, per_page=10):
+        """Returns (entries, total) for one page of an account, newest first
+
+        Entries are (time, op, change, balance) tuples."""
+        position = self._key_index.get((server_id, user_id))
+        if position is None:
+            return [], 0
+        entries = []
+        with self._lock:
+            total = self.counts[position]
+            if page == 1 and position not in self.numbers:
+                number = self.last[position]
+                while number >= 0 and len(entries) < per_page:
+                    timestamp, op, change, balance, number = self._read(number)
+                    entries.append((timestamp, LEDGER_OPS[op], change, balance))
+                return entries, total
+            numbers = self._numbers(position)
+            end = max(len(numbers) - (page - 1) * per_page, 0)
+            for number in reversed(numbers[max(end - per_page, 0):end]):
+                timestamp, op, change, balance, previous = self._read(number)
+                entries.append((timestamp, LEDGER_OPS[op], change, balance))
+        return entries, total
+
+    def balances(self):
+        """Replays every record and returns ({key: balance}, [keys whose chain doesn't add up])"""
+        balances = {}
+        broken = set()
+        with open(self._records_path, "rb") as f:
+            data = f.read(self._count * LEDGER_RECORD.size)
+        for timestamp, position, op, change, balance, previous in LEDGER_RECORD.iter_unpack(data):
+            key = self.keys[position]
+            # The first entry of accounts older than the ledger has nothing to add up to
+            if key in balances and LEDGER_OPS[op] not in ("create", "set", "checkpoint") and balances[key] + change != balance:
+                broken.add(key)
+            balances[key] = balance
+        return balances, sorted(broken)
+
+    def save_index(self):
+        """Saves the in-memory index, so the next open skips the records it covers"""
+        with self._lock:
+            data = LEDGER_INDEX_HEADER.pack(self._count, len(self.keys)) + \
+                self.last.tobytes() + self.counts.tobytes()
+            self.dirty = False
+        temp_path = self._index_path + ".tmp"
+        with open(temp_path, "wb") as f:
+            f.write(data)
+        os.replace(temp_path, self._index_path)
+
+    def checkpoint(self, accounts):
+        """Records the balance of every account whose ledger ends elsewhere
+
+        Returns the accounts recorded."""
+        balances, broken = self.balances()
+        accounts = [account for account in accounts if balances.get((account.server_id, account.id)) != account.balance]
+        if accounts:
+            self.append([("checkpoint", account, 0) for account in accounts])
+        return accounts
+
+    def close(self):
+        self.save_index()
+        self._records_file.close()
+        self._keys_file.close()
+
+    def _read(self, number):
+        """Returns (time, op, change, balance, previous record) of a record, under the lock"""
+        self._records_file.seek(number * LEDGER_RECORD.size)
+        timestamp, position, op, change, balance, previous = \
+            LEDGER_RECORD.unpack(self._records_file.read(LEDGER_RECORD.size))
+        return timestamp, op, change, balance, previous
+
+    def _numbers(self, position):
+        """Returns the record numbers of an account, oldest first, under the lock"""
+        numbers = self.numbers.get(position)
+        if numbers is None:
+            numbers = array("q")
+            number = self.last[position]
+            while number >= 0:
+                numbers.append(number)
+                number = self._read(number)[4]
+            numbers.reverse()
+            self.numbers[position] = numbers
+        return numbers
+
+    def _add_key(self, key):
+        position = self._key_index[key] = len(self.keys)
+        self.keys.append(key)
+        self.last.append(-1)
+        self.counts.append(0)
+        return position
+
+    def _open(self):
+        if os.path.exists(self._keys_path):
+            with open(self._keys_path, "rb") as f:
+                data = f.read()
+            good = data.rfind(b"\n") + 1  # A crash can leave half of a line behind
+            for line in data[:good].decode("utf-8").splitlines():
+                self._add_key(tuple(line.split(" ")))
+            if good != len(data):
+                with open(self._keys_path, "r+b") as f:
+                    f.truncate(good)
+        size = os.path.getsize(self._records_path) if os.path.exists(self._records_path) else 0
+        self._count = size // LEDGER_RECORD.size
+        if self._count * LEDGER_RECORD.size != size:
+            with open(self._records_path, "r+b") as f:
+                f.truncate(self._count * LEDGER_RECORD.size)
+        indexed = self._load_index()
+        if indexed < self._count:
+            with open(self._records_path, "rb") as f:
+                f.seek(indexed * LEDGER_RECORD.size)
+                data = f.read((self._count - indexed) * LEDGER_RECORD.size)
+            for number, (timestamp, position, op, change, balance, previous) in \
+                    enumerate(LEDGER_RECORD.iter_unpack(data), indexed):
+                self.last[position] = number
+                self.counts[position] += 1
+            self.dirty = True
+        self._keys_file = open(self._keys_path, "ab")
+        self._records_file = open(self._records_path, "a+b")  # Writes always go to the end
+
+    def _load_index(self):
+        """Loads <path>.idx and returns how many records it covers, 0 if it can't be used"""
+        try:
+            with open(self._index_path, "rb") as f:
+                data = f.read()
+            count, key_count = LEDGER_INDEX_HEADER.unpack_from(data)
+        except (OSError, struct.error):
+            return 0
+        if count > self._count or key_count > len(self.keys) or \
+                len(data) != LEDGER_INDEX_HEADER.size + key_count * 16:
+            return 0  # Left behind by another ledger file
+        last, counts = array("q"), array("q")
+        last.frombytes(data[LEDGER_INDEX_HEADER.size:LEDGER_INDEX_HEADER.size + key_count * 8])
+        counts.frombytes(data[LEDGER_INDEX_HEADER.size + key_count * 8:])
+        self.last[:key_count] = last
+        self.counts[:key_count] = counts
+        return count
+
+
+class Account:
+    """Read-only bank account record.
+
+    The bank hands out the records it stores instead of copies, and swaps in
+    a new record whenever an account changes. bot is the bot of the bank
+    that made the record, used to look up server and member."""
+
+    __slots__ = ("id", "server_id", "name", "balance", "created", "bot")
+
+    def __init__(self, id, server_id, name, balance, created, bot=None):
+        object.__setattr__(self, "id", id)
+        object.__setattr__(self, "server_id", server_id)
+        object.__setattr__(self, "name", name)
+        object.__setattr__(self, "balance", balance)
+        object.__setattr__(self, "created", created)
+        object.__setattr__(self, "bot", bot)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Account records are read-only")
+
+    def __repr__(self):
+        return "Account(id={0.id!r}, server_id={0.server_id!r}, name={0.name!r}, " \
+               "balance={0.balance!r}, created={0.created!r})".format(self)
+
+    @property
+    def created_at(self):
+        return datetime.fromtimestamp(self.created)
+
+    @property
+    def server(self):
+        """The account's server, or None if the bot isn't in it"""
+        return self.bot.get_server(self.server_id) if self.bot is not None else None
+
+    @property
+    def member(self):
+        """The account's member, or None if they aren't on the server anymore"""
+        server = self.server
+        return server.get_member(self.id) if server is not None else None
+
+    def with_balance(self, balance):
+        return Account(self.id, self.server_id, self.name, balance, self.created, self.bot)
+
+    @classmethod
+    def from_json(cls, server_id, user_id, data, bot=None):
+        date, clock = data["created_at"].split(" ")
+        fields = tuple(map(int, date.split("-") + clock.split(":")))
+        # Older saves can hold balances like 525.0; the ledger and snapshots need integers
+        return cls(user_id, server_id, data["name"], int(data["balance"]),
+                   int(time.mktime(fields + (0, 0, -1))), bot)
+
+    def to_json(self):
+        return {"name" : self.name,
+                "balance" : self.balance,
+                "created_at" : time.strftime(TIMESTAMP_FORMAT, time.localtime(self.created))
+                }
+
+
+def read_json_snapshot(file_path, bot=None):
+    """Returns (accounts, legacy_accounts) from a bank.json style file"""
+    accounts = {}
+    legacy_accounts = {}  # Pre-multiserver accounts, keyed by user id
+    for key, value in dataIO.load_json(file_path).items():
+        if "balance" in value:
+            legacy_accounts[key] = value
+        else:
+            accounts[key] = {user_id: Account.from_json(key, user_id, data, bot)
+                             for user_id, data in value.items()}
+    return accounts, legacy_accounts
+
+
+def write_json_snapshot(file_path, accounts, legacy_accounts):
+    data = dict(legacy_accounts)
+    for server_id, server_accounts in accounts.items():
+        data[server_id] = {user_id: account.to_json()
+                           for user_id, account in server_accounts.items()}
+    dataIO.save_json(file_path, data)
+
+
+def read_binary_snapshot(file_path, bot=None):
+    """Returns (accounts, legacy_accounts) from a bank.bin snapshot"""
+    ids, columns, names, legacy_accounts = read_snapshot_columns(file_path)
+    accounts = {}
+    decoded = {}
+    for server, user, balance, created, offset in zip(*columns):
+        name = decoded.get(offset)
+        if name is None:
+            name = decoded[offset] = names[offset:names.index(b"\0", offset)].decode("utf-8")
+        server_id = ids[server]
+        server_accounts = accounts.get(server_id)
+        if server_accounts is None:
+            server_accounts = accounts[server_id] = {}
+        server_accounts[ids[user]] = Account(ids[user], server_id, name, balance, created, bot)
+    return accounts, legacy_accounts
+
+
+def write_binary_snapshot(file_path, accounts, legacy_accounts):
+    ids = {}
+    names = {}
+    name_table = bytearray()
+    columns = [array(typecode) for typecode in SNAPSHOT_COLUMNS]
+    servers, users, balances, created, offsets = columns
+    for server_id, server_accounts in accounts.items():
+        server = ids.setdefault(server_id, len(ids))
+        for account in server_accounts.values():
+            offset = names.get(account.name)
+            if offset is None:
+                offset = names[account.name] = len(name_table)
+                name_table += account.name.replace("\0", "").encode("utf-8") + b"\0"
+            servers.append(server)
+            users.append(ids.setdefault(account.id, len(ids)))
+            balances.append(int(account.balance))  # Older payouts could leave fractional balances
+            created.append(account.created)
+            offsets.append(offset)
+    write_snapshot_columns(file_path, list(ids), columns, name_table, legacy_accounts)
+
+
+def read_snapshot_columns(file_path):
+    """Returns (ids, columns, name_table, legacy_accounts) from a bank.bin snapshot.
+
+    The file holds a header, the interned server and user ids, one column
+    per account field and a table of NUL-terminated names. Each column is
+    read into an array with a single copy."""
+    with open(file_path, "rb") as f:
+        data = memoryview(f.read())
+    magic, version, flags, ids_size, count, names_size, legacy_size = \
+        SNAPSHOT_HEADER.unpack_from(data)
+    if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+        raise ValueError("{} is not a bank snapshot".format(file_path))
+    pos = SNAPSHOT_HEADER.size
+    ids = bytes(data[pos:pos + ids_size]).decode("utf-8").split("\n")
+    pos += ids_size
+    columns = []
+    for typecode in SNAPSHOT_COLUMNS:
+        column = array(typecode)
+        end = pos + count * column.itemsize
+        column.frombytes(data[pos:end])
+        if flags & SNAPSHOT_BIG_ENDIAN != (sys.byteorder == "big"):
+            column.byteswap()
+        columns.append(column)
+        pos = end
+    names = bytes(data[pos:pos + names_size])
+    pos += names_size
+    legacy_accounts = json.loads(bytes(data[pos:pos + legacy_size]).decode("utf-8")) if legacy_size else {}
+    return ids, columns, names, legacy_accounts
+
+
+def write_snapshot_columns(file_path, ids, columns, name_table, legacy_accounts):
+    id_table = "\n".join(ids).encode("utf-8")
+    legacy = json.dumps(legacy_accounts).encode("utf-8") if legacy_accounts else b""
+    flags = SNAPSHOT_BIG_ENDIAN if sys.byteorder == "big" else 0
+    temp_path = file_path + ".tmp"
+    with open(temp_path, "wb") as f:
+        f.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, flags, len(id_table),
+                                     len(columns[0]), len(name_table), len(legacy)))
+        f.write(id_table)
+        for column in columns:
+            column.tofile(f)
+        f.write(name_table)
+        f.write(legacy)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, file_path)
+
+
+class BalanceIndex:
+    """Ids ordered by balance, highest first.
+
+    Keys are kept in sorted buckets of at most 2 * load entries, so an update
+    only shifts one small list and rank lookups only sum bucket sizes."""
+
+    def __init__(self, load=512):
+        self._load = load
+        self._buckets = []
+        self._maxes = []
+        self._keys = {}
+        self._offsets = None
+
+    @classmethod
+    def from_items(cls, items, load=512):
+        """Builds an index from (id, balance) pairs with a single sort"""
+        index = cls(load)
+        index._keys = {item_id: (-balance, item_id) for item_id, balance in items}
+        keys = sorted(index._keys.values())
+        index._buckets = [keys[i:i + load] for i in range(0, len(keys), load)]
+        index._maxes = [bucket[-1] for bucket in index._buckets]
+        return index
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __contains__(self, item_id):
+        return item_id in self._keys
+
+    def set(self, item_id, balance):
+        self.discard(item_id)
+        key = (-balance, item_id)
+        self._keys[item_id] = key
+        self._offsets = None
+        if not self._buckets:
+            self._buckets.append([key])
+            self._maxes.append(key)
+            return
+        pos = bisect_left(self._maxes, key)
+        if pos == len(self._maxes):
+            pos -= 1
+            self._buckets[pos].append(key)
+            self._maxes[pos] = key
+        else:
+            insort(self._buckets[pos], key)
+        bucket = self._buckets[pos]
+        if len(bucket) > self._load * 2:
+            self._buckets.insert(pos + 1, bucket[self._load:])
+            del bucket[self._load:]
+            self._maxes.insert(pos, bucket[-1])
+
+    def discard(self, item_id):
+        key = self._keys.pop(item_id, None)
+        if key is None:
+            return
+        self._offsets = None
+        pos = bisect_left(self._maxes, key)
+        bucket = self._buckets[pos]
+        del bucket[bisect_left(bucket, key)]
+        if bucket:
+            self._maxes[pos] = bucket[-1]
+        else:
+            del self._buckets[pos]
+            del self._maxes[pos]
+
+    def top(self):
+        """Yields (id, balance) pairs from the highest balance down"""
+        for bucket in self._buckets:
+            for balance, item_id in bucket:
+                yield item_id, -balance
+
+    def rank(self, item_id):
+        """1-based position of item_id, or None if it isn't indexed"""
+        key = self._keys.get(item_id)
+        if key is None:
+            return None
+        if self._offsets is None:
+            self._offsets = [0] + list(accumulate(len(b) for b in self._buckets))
+        pos = bisect_left(self._maxes, key)
+        return self._offsets[pos] + bisect_left(self._buckets[pos], key) + 1
+
+
+class Transaction:
+    """Batch of bank operations applied all at once.
+
+    Operations are only staged until commit(), which validates all of them
+    and then applies them with a single save. If any of them fails, the bank
+    is left untouched. Used as a context manager it commits on a clean exit
+    and discards everything if the block raises."""
+
+    def __init__(self, bank):
+        self.bank = bank
+        self.operations = []
+        self.holds = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.commit()
+
+    def deposit(self, user, amount):
+        self._stage("deposit", user, amount)
+
+    def withdraw(self, user, amount):
+        self._stage("withdraw", user, amount)
+
+    def set(self, user, amount):
+        self._stage("set", user, amount)
+
+    def transfer(self, sender, receiver, amount):
+        if sender.server.id == receiver.server.id and sender.id == receiver.id:
+            raise SameSenderAndReceiver()
+        self._stage("transfer_out", sender, amount)
+        self._stage("transfer_in", receiver, amount)
+
+    def capture(self, hold_id, user=None, amount=None):
+        """Takes the credits set aside by a hold
+
+        If the bank no longer knows the hold, say because the economy cog
+        was reloaded and released it, amount is taken from user instead when
+        they're given. Like a capture, that takes at most the balance."""
+        try:
+            hold = self.bank.holds.get(hold_id)
+        except UnknownHold:
+            if user is None:
+                raise
+            self._stage("capture", user, amount)
+            return
+        self._stage("capture", hold.user, hold.amount)
+        self.holds.append(hold_id)
+
+    def commit(self):
+        operations, self.operations = self.operations, []
+        holds, self.holds = self.holds, []
+        if operations:
+            with self.bank.metrics.measure("transaction"):
+                self.bank._settle(operations, holds)
+
+    def _stage(self, op, user, amount):
+        if amount < 0:
+            raise NegativeValue()
+        self.operations.append((op, user, amount))
+
+
+class AccountLocks:
+    """Fixed pool of asyncio locks shared out by hashing account keys.
+
+    Holding the lock of an account keeps other commands from reading its
+    balance and writing it back in between. Several accounts are always
+    locked in stripe order, so two transfers between the same pair of
+    accounts can't deadlock."""
+
+    def __init__(self, stripes=256):
+        self._locks = [asyncio.Lock() for i in range(stripes)]
+
+    def __call__(self, *users):
+        stripes = sorted({hash((user.server.id, user.id)) % len(self._locks) for user in users})
+        return HeldLocks([self._locks[i] for i in stripes])
+
+    def all(self):
+        """Locks every account, for operations that touch a whole server"""
+        return HeldLocks(self._locks)
+
+
+class HeldLocks:
+    def __init__(self, locks):
+        self.locks = locks
+
+    async def __aenter__(self):
+        acquired = []
+        try:
+            for lock in self.locks:
+                await lock.acquire()
+                acquired.append(lock)
+        except BaseException:
+            for lock in reversed(acquired):
+                lock.release()
+            raise
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        for lock in reversed(self.locks):
+            lock.release()
+
+
+class OperationStats:
+    """Call count, failures and latency histogram of one bank operation"""
+
+    bounds = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+              0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)  # Seconds
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.bytes = 0
+        self.buckets = [0] * (len(self.bounds) + 1)
+
+    def record(self, elapsed, *, failed=False, nbytes=0):
+        self.count += 1
+        if failed:
+            self.errors += 1
+        self.total += elapsed
+        self.bytes += nbytes
+        self.buckets[bisect_left(self.bounds, elapsed)] += 1
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-th quantile, in seconds"""
+        if not self.count:
+            return None
+        target = q * self.count
+        seen = 0
+        for bound, hits in zip(self.bounds, self.buckets):
+            seen += hits
+            if seen >= target:
+                return bound
+        return float("inf")
+
+    def snapshot(self):
+        return {"count" : self.count,
+                "errors" : self.errors,
+                "total_seconds" : self.total,
+                "bytes" : self.bytes,
+                "buckets" : dict(zip([str(b) for b in self.bounds] + ["+Inf"], self.buckets)),
+                "p50_seconds" : self.quantile(0.5),
+                "p99_seconds" : self.quantile(0.99)}
+
+
+class BankMetrics:
+    """Counters and latency histograms of every bank operation.
+
+    Saves may run on worker threads, so recording takes a lock."""
+
+    def __init__(self):
+        self.operations = defaultdict(OperationStats)
+        self.started = time.time()
+        self._lock = threading.Lock()
+
+    def measure(self, name):
+        return MeasuredCall(self, name)
+
+    def record(self, name, elapsed, *, failed=False, nbytes=0):
+        with self._lock:
+            self.operations[name].record(elapsed, failed=failed, nbytes=nbytes)
+
+    def snapshot(self):
+        with self._lock:
+            return {"uptime_seconds" : time.time() - self.started,
+                    "operations" : {name: stats.snapshot() for name, stats in self.operations.items()}}
+
+
+class MeasuredCall:
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+        self.nbytes = 0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.metrics.record(self.name, time.perf_counter() - self.start,
+                            failed=exc_type is not None, nbytes=self.nbytes)
+
+
+def measured(name):
+    """Records calls of a bank method under name in bank.metrics"""
+    def decorator(function):
+        @wraps(function)
+        def wrapper(self, *args, **kwargs):
+            with self.metrics.measure(name):
+                return function(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class BaseBank:
+    """Bank logic shared by every storage backend.
+
+    Backends only look accounts up and store them; validation happens here
+    so they all behave the same."""
+
+    journal = None
+    ledger = None
+    dirty = False
+
+    def __init__(self, bot):
         self.bot = bot
+        self.lock = AccountLocks()
+        self.metrics = BankMetrics()
+        self.holds = HoldRegistry()
 
+    @measured("create")
     def create_account(self, user, *, initial_balance=0):
-        server = user.server
-        if not self.account_exists(user):
-            if server.id not in self.accounts:
-                self.accounts[server.id] = {}
-            if user.id in self.accounts:  # Legacy account
-                balance = self.accounts[user.id]["balance"]
-            else:
-                balance = initial_balance
-            timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            account = {"name" : user.name,
-                       "balance" : balance,
-                       "created_at" : timestamp
-                       }
-            self.accounts[server.id][user.id] = account
-            self._save_bank()
-            return self.get_account(user)
-        else:
+        if self.account_exists(user):
             raise AccountAlreadyExists()
+        balance = self._legacy_balance(user.id)
+        if balance is None:
+            balance = initial_balance
+        account = Account(user.id, user.server.id, user.name, balance, int(time.time()), self.bot)
+        self._store_recorded([("create", account, balance)])
+        return account
 
     def account_exists(self, user):
         try:
@@ -71,118 +1134,1764 @@ class Bank:
             return False
         return True
 
+    @measured("withdraw")
     def withdraw_credits(self, user, amount):
-        server = user.server
-
         if amount < 0:
             raise NegativeValue()
+        self._commit([("withdraw", user, amount)])
 
-        account = self._get_account(user)
-        if account["balance"] >= amount:
-            account["balance"] -= amount
-            self.accounts[server.id][user.id] = account
-            self._save_bank()
-        else:
-            raise InsufficientBalance()
-
+    @measured("deposit")
     def deposit_credits(self, user, amount):
-        server = user.server
         if amount < 0:
             raise NegativeValue()
-        account = self._get_account(user)
-        account["balance"] += amount
-        self.accounts[server.id][user.id] = account
-        self._save_bank()
+        self._commit([("deposit", user, amount)])
 
+    @measured("set")
     def set_credits(self, user, amount):
-        server = user.server
         if amount < 0:
             raise NegativeValue()
-        account = self._get_account(user)
-        account["balance"] = amount
-        self.accounts[server.id][user.id] = account
-        self._save_bank()
+        self._commit([("set", user, amount)])
 
+    @measured("transfer")
     def transfer_credits(self, sender, receiver, amount):
         if amount < 0:
             raise NegativeValue()
-        if sender is receiver:
+        if sender.server.id == receiver.server.id and sender.id == receiver.id:
             raise SameSenderAndReceiver()
         if self.account_exists(sender) and self.account_exists(receiver):
-            sender_acc = self._get_account(sender)
-            if sender_acc["balance"] < amount:
-                raise InsufficientBalance()
-            self.withdraw_credits(sender, amount)
-            self.deposit_credits(receiver, amount)
+            self._commit([("transfer_out", sender, amount), ("transfer_in", receiver, amount)])
         else:
             raise NoAccount()
 
-    def can_spend(self, user, amount):
-        account = self._get_account(user)
-        if account["balance"] >= amount:
-            return True
+    def transaction(self):
+        return Transaction(self)
+
+    @measured("bulk")
+    def bulk_apply(self, server, *, delta=None, value=None, predicate=None):
+        """Adds delta to, or sets value on, every account of server at once
+
+        Only accounts for which predicate(account) is true are touched.
+        Negative deltas stop at 0, or at the credits held for the account.
+        Everything is saved in a single write
+        and the updated accounts are returned."""
+        if (delta is None) == (value is None):
+            raise ValueError("Exactly one of delta and value is needed")
+        if value is not None and value < 0:
+            raise NegativeValue()
+        entries = []
+        for account in self.iter_accounts(server):
+            if predicate is not None and not predicate(account):
+                continue
+            if value is not None:
+                balance = value
+            else:
+                floor = min(account.balance, self.holds.held(account.server_id, account.id))
+                balance = max(floor, account.balance + delta)
+            if balance != account.balance:
+                entries.append(("bulk", account.with_balance(balance), balance - account.balance))
+        if entries:
+            self._store_recorded(entries)
+        return [account for op, account, change in entries]
+
+    def reserve(self, user, amount, *, tag=None):
+        """Sets credits aside for later and returns the hold id
+
+        Held credits can't be spent elsewhere until the hold is released
+        or captured."""
+        if amount < 0:
+            raise NegativeValue()
+        if self.get_available(user) < amount:
+            raise InsufficientBalance()
+        return self.holds.add(user, amount, tag).id
+
+    def adjust_hold(self, hold_id, amount):
+        if amount < 0:
+            raise NegativeValue()
+        hold = self.holds.get(hold_id)
+        if self.get_available(hold.user) + hold.amount < amount:
+            raise InsufficientBalance()
+        self.holds.resize(hold_id, amount)
+
+    def release(self, hold_id):
+        """Gives held credits back without taking them"""
+        self.holds.pop(hold_id)
+
+    def capture(self, hold_id):
+        with self.transaction() as transaction:
+            transaction.capture(hold_id)
+
+    def hold_amount(self, hold_id):
+        return self.holds.get(hold_id).amount
+
+    def can_spend(self, user, amount, *, hold=None):
+        """Whether user has amount available, counting hold's credits as available"""
+        available = self.get_available(user)
+        if hold is not None:
+            available += self.hold_amount(hold)
+        return available >= amount
+
+    def get_available(self, user):
+        """Balance minus held credits"""
+        return self._get_account(user).balance - self.holds.held(user.server.id, user.id)
+
+    def get_server_accounts(self, server):
+        return list(self.iter_accounts(server))
+
+    def get_all_accounts(self):
+        return list(self.iter_all_accounts())
+
+    def iter_all_accounts(self):
+        """Yields the accounts of every server the bot is still in"""
+        joined = {}
+        for account in self.iter_accounts():
+            if account.server_id not in joined:
+                joined[account.server_id] = self.bot.get_server(account.server_id) is not None
+            if joined[account.server_id]:  # Servers that have since been left will be ignored
+                yield account
+
+    def get_balance(self, user):
+        return self._get_account(user).balance
+
+    def get_account(self, user):
+        return self._get_account(user)
+
+    def count_accounts(self):
+        return sum(1 for account in self.iter_accounts())
+
+    def total_supply(self, server=None):
+        """Credits held by every account of a server, or of the whole bank"""
+        return sum(account.balance for account in self.iter_accounts(server))
+
+    def median_balance(self, server=None):
+        balances = [account.balance for account in self.iter_accounts(server)]
+        return statistics.median(balances) if balances else None
+
+    def history(self, user, page=1, per_page=10):
+        """Returns (entries, total) for a page of user's ledger, newest first"""
+        if self.ledger is None:
+            raise BankError("The ledger is disabled")
+        return self.ledger.history(user.server.id, user.id, page, per_page)
+
+    def verify_ledger(self):
+        """Returns (mismatches, broken)
+
+        mismatches lists (server id, user id, ledger balance, bank balance) for
+        accounts that don't match their ledger, broken lists (server id, user id)
+        of ledgers whose entries don't add up."""
+        if self.ledger is None:
+            raise BankError("The ledger is disabled")
+        balances, broken = self.ledger.balances()
+        mismatches = []
+        for account in self.iter_accounts():
+            expected = balances.get((account.server_id, account.id))
+            if expected is not None and expected != account.balance:
+                mismatches.append((account.server_id, account.id, expected, account.balance))
+        return mismatches, broken
+
+    def checkpoint_ledger(self):
+        """Records balances that changed while the ledger wasn't recording them
+
+        Returns the accounts recorded. Call it whenever the ledger is turned
+        on or accounts are loaded from elsewhere, so rebuild_from_ledger never
+        goes back to an older balance."""
+        if self.ledger is None:
+            raise BankError("The ledger is disabled")
+        return self.ledger.checkpoint(self.iter_accounts())
+
+    def rebuild_from_ledger(self):
+        """Sets every account back to the balance its ledger ends with"""
+        if self.ledger is None:
+            raise BankError("The ledger is disabled")
+        balances, broken = self.ledger.balances()
+        accounts = []
+        for account in self.iter_accounts():
+            expected = balances.get((account.server_id, account.id))
+            if expected is not None and expected != account.balance:
+                accounts.append(account.with_balance(expected))
+        if accounts:
+            self._store(accounts)
+        return accounts
+
+    def stats(self):
+        """Snapshot of the bank's metrics, safe to hand to other tooling"""
+        stats = self.metrics.snapshot()
+        stats["backend"] = type(self).__name__
+        stats["accounts"] = self.count_accounts()
+        return stats
+
+    def iter_accounts(self, server=None):
+        """Yields every stored account, or those of one server"""
+        raise NotImplementedError()
+
+    def load_accounts(self, accounts):
+        """Replaces every account in the bank with the given ones"""
+        raise NotImplementedError()
+
+    def wipe_bank(self, server):
+        raise NotImplementedError()
+
+    def _record_wipe(self, server):
+        """Records every account of server going to 0 before a wipe removes it"""
+        if self.ledger is not None:
+            self.ledger.append([("wipe", account.with_balance(0), -account.balance)
+                                for account in self.iter_accounts(server)])
+
+    def get_leaderboard(self, server=None, top=10):
+        """Top accounts of a server, or of every server with each user listed
+        once at their highest balance"""
+        raise NotImplementedError()
+
+    def get_rank(self, user, *, global_rank=False):
+        """1-based leaderboard position of user, or None without an account"""
+        raise NotImplementedError()
+
+    async def flush(self):
+        pass
+
+    async def offload(self, func, *args, **kwargs):
+        """Calls func(*args, **kwargs), a method of this bank, for a coroutine
+
+        Local banks answer from memory or local files, so they call it
+        right away; a bank behind a network round trip uses a worker thread
+        instead of blocking the event loop."""
+        return func(*args, **kwargs)
+
+    def release_idle(self):
+        """Drops in-memory data that hasn't been used for a while"""
+        pass
+
+    def close(self):
+        pass
+
+    def _commit(self, operations, held=None):
+        """Applies (op, user, amount) operations with a single store
+
+        held maps (server id, user id) to credits held outside this bank's
+        own holds, such as by the client of a bank service."""
+        held = held or {}
+        accounts = {}
+        entries = []
+        for op, user, amount in operations:
+            key = (user.server.id, user.id)
+            account = accounts.get(key)
+            if account is None:
+                account = self._get_account(user)
+            if op in ("withdraw", "transfer_out"):
+                if account.balance - self.holds.held(*key) - held.get(key, 0) < amount:
+                    raise InsufficientBalance()
+                change = -amount
+            elif op == "capture":  # The hold was popped already; never fails so games can always settle
+                change = -min(amount, account.balance)
+            elif op in ("deposit", "transfer_in"):
+                change = amount
+            else:
+                change = amount - account.balance
+            account = account.with_balance(account.balance + change)
+            accounts[key] = account
+            entries.append((op, account, change))
+        self._store_recorded(entries, list(accounts.values()))
+
+    def _store_recorded(self, entries, accounts=None):
+        """Stores the accounts of (op, account, change) entries along with their ledger records
+
+        The records are checked before anything is stored, so a balance is
+        never changed without its ledger entry."""
+        if accounts is None:
+            accounts = [account for op, account, change in entries]
+        if any(account.balance > MAX_BALANCE for account in accounts):
+            raise BalanceTooLarge()
+        records = self.ledger.prepare(entries) if self.ledger is not None else None
+        self._store(accounts)
+        if records is not None:
+            self.ledger.write(records)
+
+    def _settle(self, operations, holds):
+        # A hold released since it was staged is still charged by its operation
+        captured = [self.holds.pop(hold_id) for hold_id in holds if hold_id in self.holds]
+        try:
+            self._commit(operations)
+        except Exception:
+            for hold in captured:
+                self.holds.restore(hold)
+            raise
+
+    def _get_account(self, user):
+        raise NotImplementedError()
+
+    def _store(self, accounts):
+        """Writes the given accounts all at once, or none of them"""
+        raise NotImplementedError()
+
+    def _legacy_balance(self, user_id):
+        return None
+
+
+class Bank(BaseBank):
+    """Bank held in memory and saved to a snapshot file.
+
+    Snapshots ending in .bin use the binary format, anything else is json.
+    A missing binary snapshot is created from json_path."""
+
+    def __init__(self, bot, file_path, *, journal=False, fsync=False, write_behind=False, json_path=None):
+        super().__init__(bot)
+        self.file_path = file_path
+        self.binary = file_path.endswith(".bin")
+        self._save_lock = threading.Lock()
+        self._taken = 0  # Snapshots numbered in the order they were taken
+        self._written = 0  # Number of the newest snapshot on disk
+        with self.metrics.measure("load"):
+            if self.binary and not os.path.exists(file_path):
+                self.accounts, self.legacy_accounts = {}, {}
+                if json_path is not None and dataIO.is_valid_json(json_path):
+                    self.accounts, self.legacy_accounts = read_json_snapshot(json_path, bot)
+                self._write(self.accounts)
+            elif self.binary:
+                self.accounts, self.legacy_accounts = read_binary_snapshot(file_path, bot)
+            else:
+                self.accounts, self.legacy_accounts = read_json_snapshot(file_path, bot)
+        self.write_behind = write_behind
+        self.dirty = False
+        self.journal = None
+        journal_path = os.path.splitext(file_path)[0] + ".journal"
+        if journal or os.path.exists(journal_path):
+            self.journal = BankJournal(journal_path, fsync=fsync)
+            replayed = 0
+            for record in self.journal.replay():
+                self._apply_record(record)
+                replayed += 1
+            if replayed:
+                self.compact()
+            if not journal:
+                self.set_journal(False)
+        self._build_index()
+
+    def account_exists(self, user):
+        server_accounts = self.accounts.get(user.server.id)
+        return server_accounts is not None and user.id in server_accounts
+
+    def iter_accounts(self, server=None):
+        if server is not None:
+            yield from list(self.accounts.get(server.id, {}).values())
         else:
-            return False
+            for server_accounts in list(self.accounts.values()):
+                yield from list(server_accounts.values())
+
+    def load_accounts(self, accounts):
+        self.accounts = {}
+        for account in accounts:
+            self.accounts.setdefault(account.server_id, {})[account.id] = account
+        self._build_index()
+        self.compact()
 
     def wipe_bank(self, server):
+        self._record_wipe(server)
+        for user_id in self.accounts.get(server.id, ()):
+            self._remove_index(server.id, user_id)
+        self._server_index.pop(server.id, None)
         self.accounts[server.id] = {}
+        if self.journal is not None:
+            self.journal.append([{"op" : "wipe", "server" : server.id}])
+        elif self.write_behind:
+            self.dirty = True
+        else:
+            self._save_bank()
+
+    @measured("leaderboard")
+    def get_leaderboard(self, server=None, top=10):
+        if server is None:
+            return self._global_leaderboard(top)
+        index = self._server_index.get(server.id)
+        if index is None:
+            return []
+        return [self.accounts[server.id][user_id] for user_id, balance in islice(index.top(), top)]
+
+    def _global_leaderboard(self, top):
+        accounts = []
+        fallbacks = []  # (-balance, user id, account) of users whose best server has been left
+        for user_id, balance in self._global_index.top():
+            while fallbacks and fallbacks[0][:2] <= (-balance, user_id) and len(accounts) < top:
+                accounts.append(heappop(fallbacks)[2])
+            if len(accounts) >= top:
+                break
+            server_id = self._best_server[user_id]
+            if self.bot.get_server(server_id) is not None:
+                accounts.append(self.accounts[server_id][user_id])
+                continue
+            # Servers that have since been left will be ignored, so rank the user by their best remaining one
+            balances = self._user_balances[user_id]
+            joined = [server_id for server_id in balances if self.bot.get_server(server_id) is not None]
+            if joined:
+                server_id = max(joined, key=balances.get)
+                heappush(fallbacks, (-balances[server_id], user_id, self.accounts[server_id][user_id]))
+        while fallbacks and len(accounts) < top:
+            accounts.append(heappop(fallbacks)[2])
+        return accounts
+
+    def get_rank(self, user, *, global_rank=False):
+        if global_rank:
+            return self._global_index.rank(user.id)
+        index = self._server_index.get(user.server.id)
+        return index.rank(user.id) if index is not None else None
+
+    def _build_index(self):
+        self._server_index = {}
+        self._user_balances = {}  # user id -> {server id: balance}
+        self._best_server = {}  # user id -> server id of their highest balance
+        for server_id, server_accounts in self.accounts.items():
+            self._server_index[server_id] = BalanceIndex.from_items(
+                (user_id, account.balance) for user_id, account in server_accounts.items())
+            for user_id, account in server_accounts.items():
+                self._user_balances.setdefault(user_id, {})[server_id] = account.balance
+        for user_id, balances in self._user_balances.items():
+            self._best_server[user_id] = max(balances, key=balances.get)
+        self._global_index = BalanceIndex.from_items(
+            (user_id, self._user_balances[user_id][server_id]) for user_id, server_id in self._best_server.items())
+
+    def _update_index(self, server_id, user_id, balance):
+        index = self._server_index.get(server_id)
+        if index is None:
+            index = self._server_index[server_id] = BalanceIndex()
+        index.set(user_id, balance)
+        balances = self._user_balances.setdefault(user_id, {})
+        balances[server_id] = balance
+        self._reindex_user(user_id, balances)
+
+    def _remove_index(self, server_id, user_id):
+        index = self._server_index.get(server_id)
+        if index is not None:
+            index.discard(user_id)
+        balances = self._user_balances.get(user_id, {})
+        balances.pop(server_id, None)
+        if balances:
+            self._reindex_user(user_id, balances)
+        else:
+            self._user_balances.pop(user_id, None)
+            self._best_server.pop(user_id, None)
+            self._global_index.discard(user_id)
+
+    def _reindex_user(self, user_id, balances):
+        best = max(balances, key=balances.get)
+        self._best_server[user_id] = best
+        self._global_index.set(user_id, balances[best])
+
+    def set_journal(self, enabled, *, fsync=False):
+        if enabled and self.journal is None:
+            self._save_bank()
+            self.journal = BankJournal(os.path.splitext(self.file_path)[0] + ".journal", fsync=fsync)
+            for record in self.journal.replay():
+                self._apply_record(record)
+        elif not enabled and self.journal is not None:
+            self._save_bank()
+            self.journal.close()
+            os.remove(self.journal.file_path)
+            self.journal = None
+
+    def set_snapshot(self, file_path):
+        """Saves the bank to file_path and uses it as the snapshot from then on"""
+        with self._save_lock:
+            self.file_path = file_path
+            self.binary = file_path.endswith(".bin")
+        self.compact()
+
+    def compact(self):
+        """Writes a fresh snapshot and empties the journal"""
         self._save_bank()
+        if self.journal is not None:
+            self.journal.truncate()
+
+    async def compact_async(self):
+        """Like compact(), but writes the snapshot from a worker thread
+
+        Records journaled while it is written stay in the journal."""
+        journal = self.journal
+        size = journal.size if journal is not None else 0
+        self.dirty = False
+        data = self.snapshot()
+        self._taken += 1
+        try:
+            await self.bot.loop.run_in_executor(None, self._write, data, self._taken)
+        except Exception:
+            self.dirty = True
+            raise
+        if journal is not None and journal is self.journal:
+            journal.discard(size)
+
+    def snapshot(self):
+        """Point-in-time copy of the bank that is safe to serialize from another thread
+
+        Account records are read-only, so copying the two outer levels is enough."""
+        return {k: dict(v) for k, v in self.accounts.items()}
+
+    async def flush(self):
+        """Writes pending changes to disk from a worker thread"""
+        if not self.dirty:
+            return
+        self.dirty = False
+        data = self.snapshot()
+        self._taken += 1
+        try:
+            await self.bot.loop.run_in_executor(None, self._write, data, self._taken)
+        except Exception:
+            self.dirty = True
+            raise
+
+    def close(self):
+        if self.journal is not None:
+            self.compact()
+            self.journal.close()
+        elif self.dirty:
+            self._save_bank()
 
-    def get_server_accounts(self, server):
-        if server.id in self.accounts:
-            raw_server_accounts = deepcopy(self.accounts[server.id])
+    def _persist(self, accounts):
+        if self.journal is not None:
+            with self.metrics.measure("journal") as call:
+                size = self.journal.size
+                self.journal.append([{"op" : "put",
+                                      "server" : account.server_id,
+                                      "user" : account.id,
+                                      "account" : account.to_json()}
+                                     for account in accounts])
+                call.nbytes = self.journal.size - size
+        elif self.write_behind:
+            self.dirty = True
+        else:
+            self._save_bank()
+
+    def _save_bank(self):
+        self.dirty = False
+        self._taken += 1
+        self._write(self.accounts, self._taken)
+
+    def _write(self, accounts, number=None):
+        """Saves a snapshot, unless number is given and a newer snapshot has been saved already"""
+        write = write_binary_snapshot if self.binary else write_json_snapshot
+        with self._save_lock:
+            if number is not None and number < self._written:
+                return
+            with self.metrics.measure("save") as call:
+                write(self.file_path, accounts, self.legacy_accounts)
+                call.nbytes = os.path.getsize(self.file_path)
+            if number is not None:
+                self._written = number
+
+    def count_accounts(self):
+        return sum(len(server_accounts) for server_accounts in self.accounts.values())
+
+    def _apply_record(self, record):
+        if record["op"] == "put":
+            self.accounts.setdefault(record["server"], {})[record["user"]] = \
+                Account.from_json(record["server"], record["user"], record["account"], self.bot)
+        elif record["op"] == "wipe":
+            self.accounts[record["server"]] = {}
+
+    def _get_account(self, user):
+        try:
+            return self.accounts[user.server.id][user.id]
+        except KeyError:
+            raise NoAccount()
+
+    def _store(self, accounts):
+        previous = []
+        for account in accounts:
+            server_accounts = self.accounts.setdefault(account.server_id, {})
+            previous.append((account, server_accounts.get(account.id)))
+            server_accounts[account.id] = account
+            self._update_index(account.server_id, account.id, account.balance)
+        try:
+            self._persist(accounts)
+        except Exception:
+            for account, old in reversed(previous):
+                if old is None:
+                    del self.accounts[account.server_id][account.id]
+                    self._remove_index(account.server_id, account.id)
+                else:
+                    self.accounts[old.server_id][old.id] = old
+                    self._update_index(old.server_id, old.id, old.balance)
+            raise
+
+    def _legacy_balance(self, user_id):
+        if user_id in self.legacy_accounts:
+            return int(self.legacy_accounts[user_id]["balance"])
+        return None
+
+
+class SQLiteBank(BaseBank):
+    """Bank stored in an SQLite database.
+
+    Lookups, leaderboards and wipes are indexed queries, so memory use stays
+    flat as the bank grows. A new database is filled from bank.json."""
+
+    def __init__(self, bot, file_path, *, json_path=None):
+        super().__init__(bot)
+        self.file_path = file_path
+        with self.metrics.measure("load"):
+            self._open(json_path)
+
+    def _open(self, json_path):
+        self.conn = sqlite3.connect(self.file_path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        with self.conn:
+            self.conn.execute("CREATE TABLE IF NOT EXISTS accounts ("
+                              "server_id TEXT NOT NULL, user_id TEXT NOT NULL, name TEXT NOT NULL, "
+                              "balance INTEGER NOT NULL, created_at INTEGER NOT NULL, "
+                              "PRIMARY KEY (server_id, user_id)) WITHOUT ROWID")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS accounts_server_balance "
+                              "ON accounts (server_id, balance DESC, user_id)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS accounts_balance "
+                              "ON accounts (balance DESC, user_id)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS accounts_user "
+                              "ON accounts (user_id, balance)")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS legacy_accounts ("
+                              "user_id TEXT PRIMARY KEY, balance INTEGER NOT NULL)")
+        empty = self.conn.execute("SELECT NOT EXISTS (SELECT 1 FROM accounts) "
+                                  "AND NOT EXISTS (SELECT 1 FROM legacy_accounts)").fetchone()[0]
+        if empty and json_path is not None and dataIO.is_valid_json(json_path):
+            self._import_json(json_path)
+
+    def account_exists(self, user):
+        return self.conn.execute("SELECT 1 FROM accounts WHERE server_id = ? AND user_id = ?",
+                                 (user.server.id, user.id)).fetchone() is not None
+
+    def iter_accounts(self, server=None):
+        if server is not None:
+            cursor = self.conn.execute("SELECT * FROM accounts WHERE server_id = ?", (server.id,))
+        else:
+            cursor = self.conn.execute("SELECT * FROM accounts")
+        for row in cursor:
+            yield self._account(row)
+
+    def load_accounts(self, accounts):
+        with self.conn:
+            self.conn.execute("DELETE FROM accounts")
+            self.conn.executemany("INSERT INTO accounts VALUES (?, ?, ?, ?, ?)",
+                                  (self._row(account) for account in accounts))
+
+    def wipe_bank(self, server):
+        self._record_wipe(server)
+        with self.conn:
+            self.conn.execute("DELETE FROM accounts WHERE server_id = ?", (server.id,))
+
+    @measured("leaderboard")
+    def get_leaderboard(self, server=None, top=10):
+        if server is not None:
+            cursor = self.conn.execute("SELECT * FROM accounts WHERE server_id = ? "
+                                       "ORDER BY balance DESC, user_id LIMIT ?", (server.id, top))
+            return [self._account(row) for row in cursor]
+        accounts = []
+        seen = set()
+        for row in self.conn.execute("SELECT * FROM accounts ORDER BY balance DESC, user_id"):
+            if len(accounts) >= top:
+                break
+            account = self._account(row)
+            if account.id in seen or self.bot.get_server(account.server_id) is None:
+                continue
+            seen.add(account.id)
+            accounts.append(account)
+        return accounts
+
+    def get_rank(self, user, *, global_rank=False):
+        if global_rank:
+            balance = self.conn.execute("SELECT MAX(balance) FROM accounts WHERE user_id = ?",
+                                        (user.id,)).fetchone()[0]
+            if balance is None:
+                return None
+            ahead = self.conn.execute("SELECT COUNT(*) FROM (SELECT user_id, MAX(balance) AS best "
+                                      "FROM accounts GROUP BY user_id) "
+                                      "WHERE best > ? OR (best = ? AND user_id < ?)",
+                                      (balance, balance, user.id)).fetchone()[0]
+            return ahead + 1
+        try:
+            balance = self._get_account(user).balance
+        except NoAccount:
+            return None
+        ahead = self.conn.execute("SELECT COUNT(*) FROM accounts WHERE server_id = ? "
+                                  "AND (balance > ? OR (balance = ? AND user_id < ?))",
+                                  (user.server.id, balance, balance, user.id)).fetchone()[0]
+        return ahead + 1
+
+    def count_accounts(self):
+        return self.conn.execute("SELECT COUNT(*) FROM accounts").fetchone()[0]
+
+    def close(self):
+        self.conn.close()
+
+    def _get_account(self, user):
+        row = self.conn.execute("SELECT * FROM accounts WHERE server_id = ? AND user_id = ?",
+                                (user.server.id, user.id)).fetchone()
+        if row is None:
+            raise NoAccount()
+        return self._account(row)
+
+    def _store(self, accounts):
+        with self.metrics.measure("save"), self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO accounts VALUES (?, ?, ?, ?, ?)",
+                                  [self._row(account) for account in accounts])
+
+    def _legacy_balance(self, user_id):
+        row = self.conn.execute("SELECT balance FROM legacy_accounts WHERE user_id = ?",
+                                (user_id,)).fetchone()
+        return row[0] if row is not None else None
+
+    def _import_json(self, json_path):
+        with self.conn:
+            for key, value in dataIO.load_json(json_path).items():
+                if "balance" in value:
+                    self.conn.execute("INSERT INTO legacy_accounts VALUES (?, ?)", (key, int(value["balance"])))
+                else:
+                    self.conn.executemany("INSERT INTO accounts VALUES (?, ?, ?, ?, ?)",
+                                          (self._row(Account.from_json(key, user_id, data))
+                                           for user_id, data in value.items()))
+
+    def _account(self, row):
+        server_id, user_id, name, balance, created = row
+        return Account(user_id, server_id, name, balance, created, self.bot)
+
+    @staticmethod
+    def _row(account):
+        return (account.server_id, account.id, account.name, account.balance, account.created)
+
+
+class BankShard:
+    """Accounts and balance index of a single server"""
+
+    def __init__(self, server_id, accounts):
+        self.server_id = server_id
+        self.accounts = accounts
+        self.index = BalanceIndex()
+        for user_id, account in accounts.items():
+            self.index.set(user_id, account.balance)
+        self.last_used = time.time()
+        self.dirty = False
+
+
+class ShardedBank(BaseBank):
+    """Bank split into one json file per server.
+
+    A server's shard is read the first time one of its accounts is used and
+    dropped again after it has been idle for a while, so startup doesn't
+    parse anything and memory follows the servers that are actually playing.
+    bank.json is split into shards the first time the directory is created."""
+
+    def __init__(self, bot, directory, *, json_path=None, write_behind=False, idle=1800):
+        super().__init__(bot)
+        self.directory = directory
+        self.write_behind = write_behind
+        self.idle = idle
+        self.shards = {}
+        self._generations = {}  # Server id -> times its shard was replaced, so older flushes are dropped
+        self._save_lock = threading.Lock()
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+            if json_path is not None and dataIO.is_valid_json(json_path):
+                self._split_json(json_path)
+        self.legacy_accounts = {}
+        legacy_path = os.path.join(directory, "legacy.json")
+        if dataIO.is_valid_json(legacy_path):
+            self.legacy_accounts = dataIO.load_json(legacy_path)
+
+    @property
+    def dirty(self):
+        return any(shard.dirty for shard in self.shards.values())
+
+    def account_exists(self, user):
+        return user.id in self._shard(user.server.id).accounts
+
+    def iter_accounts(self, server=None):
+        if server is not None:
+            yield from list(self._shard(server.id).accounts.values())
+            return
+        for server_id in self._server_ids():
+            shard = self.shards.get(server_id)
+            if shard is not None:
+                yield from list(shard.accounts.values())
+            else:  # Read without keeping it around
+                yield from self._read_shard(server_id).values()
+
+    def load_accounts(self, accounts):
+        servers = {}
+        for account in accounts:
+            servers.setdefault(account.server_id, {})[account.id] = account
+        with self._save_lock:
+            for server_id in self._server_ids():
+                self._generations[server_id] = self._generations.get(server_id, 0) + 1
+                if server_id not in servers:
+                    os.remove(self._shard_path(server_id))
+        self.shards = {}
+        for server_id, server_accounts in servers.items():
+            self._write_shard(server_id, server_accounts)
+
+    def wipe_bank(self, server):
+        self._record_wipe(server)
+        self.shards[server.id] = BankShard(server.id, {})
+        path = self._shard_path(server.id)
+        with self._save_lock:  # Waits for a flush that's writing the old shard
+            self._generations[server.id] = self._generations.get(server.id, 0) + 1
+            if os.path.exists(path):
+                os.remove(path)
+
+    @measured("leaderboard")
+    def get_leaderboard(self, server=None, top=10):
+        if server is not None:
+            shard = self._shard(server.id)
             accounts = []
-            for k, v in raw_server_accounts.items():
-                v["id"] = k
-                v["server"] = server
-                acc = self._create_account_obj(v)
-                accounts.append(acc)
+            for user_id, balance in shard.index.top():
+                if len(accounts) >= top:
+                    break
+                accounts.append(shard.accounts[user_id])
             return accounts
-        else:
+        # A user's best entry can't be below the top of its own server, so the
+        # top of every server is enough to find the global top.
+        candidates = []
+        for server_id in self._server_ids():
+            if self.bot.get_server(server_id) is None:  # Servers that have since been left will be ignored
+                continue
+            shard = self.shards.get(server_id)
+            if shard is not None:
+                candidates.extend(shard.accounts[user_id] for user_id, balance in islice(shard.index.top(), top))
+            else:
+                candidates.extend(nsmallest(top, self._read_shard(server_id).values(),
+                                            key=lambda acc: (-acc.balance, acc.id)))
+        candidates.sort(key=lambda acc: (-acc.balance, acc.id))
+        accounts = []
+        seen = set()
+        for account in candidates:
+            if len(accounts) >= top:
+                break
+            if account.id not in seen:
+                seen.add(account.id)
+                accounts.append(account)
+        return accounts
+
+    def get_rank(self, user, *, global_rank=False):
+        if not global_rank:
+            return self._shard(user.server.id).index.rank(user.id)
+        best = {}
+        for account in self.iter_accounts():
+            if best.get(account.id, -1) < account.balance:
+                best[account.id] = account.balance
+        if user.id not in best:
+            return None
+        key = (-best[user.id], user.id)
+        return 1 + sum(1 for user_id, balance in best.items() if (-balance, user_id) < key)
+
+    async def flush(self):
+        """Writes changed shards to disk from a worker thread"""
+        for shard in list(self.shards.values()):
+            if not shard.dirty:
+                continue
+            shard.dirty = False
+            data = dict(shard.accounts)
+            generation = self._generations.get(shard.server_id, 0)
+            try:
+                await self.bot.loop.run_in_executor(None, self._write_shard, shard.server_id, data, generation)
+            except Exception:
+                shard.dirty = True
+                raise
+
+    def count_accounts(self):
+        count = 0
+        for server_id in self._server_ids():
+            if server_id in self.shards:
+                count += len(self.shards[server_id].accounts)
+            else:
+                count += len(dataIO.load_json(self._shard_path(server_id)))
+        return count
+
+    def release_idle(self):
+        cutoff = time.time() - self.idle
+        for server_id, shard in list(self.shards.items()):
+            if shard.last_used < cutoff and not shard.dirty:
+                del self.shards[server_id]
+
+    def close(self):
+        for shard in self.shards.values():
+            if shard.dirty:
+                shard.dirty = False
+                self._write_shard(shard.server_id, shard.accounts)
+
+    def _get_account(self, user):
+        try:
+            return self._shard(user.server.id).accounts[user.id]
+        except KeyError:
+            raise NoAccount()
+
+    def _store(self, accounts):
+        previous = []
+        touched = {}
+        for account in accounts:
+            shard = self._shard(account.server_id)
+            previous.append((shard, account, shard.accounts.get(account.id)))
+            shard.accounts[account.id] = account
+            shard.index.set(account.id, account.balance)
+            touched[shard.server_id] = shard
+        try:
+            for shard in touched.values():
+                if self.write_behind:
+                    shard.dirty = True
+                else:
+                    self._write_shard(shard.server_id, shard.accounts)
+        except Exception:
+            for shard, account, old in reversed(previous):
+                if old is None:
+                    del shard.accounts[account.id]
+                    shard.index.discard(account.id)
+                else:
+                    shard.accounts[old.id] = old
+                    shard.index.set(old.id, old.balance)
+            raise
+
+    def _legacy_balance(self, user_id):
+        if user_id in self.legacy_accounts:
+            return int(self.legacy_accounts[user_id]["balance"])
+        return None
+
+    def _shard(self, server_id):
+        shard = self.shards.get(server_id)
+        if shard is None:
+            shard = self.shards[server_id] = BankShard(server_id, self._read_shard(server_id))
+        shard.last_used = time.time()
+        return shard
+
+    def _server_ids(self):
+        server_ids = set(self.shards)
+        for name in os.listdir(self.directory):
+            server_id, ext = os.path.splitext(name)
+            if ext == ".json" and server_id != "legacy":
+                server_ids.add(server_id)
+        return server_ids
+
+    def _shard_path(self, server_id):
+        return os.path.join(self.directory, "{}.json".format(server_id))
+
+    def _read_shard(self, server_id):
+        path = self._shard_path(server_id)
+        if not os.path.exists(path):
+            return {}
+        with self.metrics.measure("load"):
+            return {user_id: Account.from_json(server_id, user_id, data, self.bot)
+                    for user_id, data in dataIO.load_json(path).items()}
+
+    def _write_shard(self, server_id, accounts, generation=None):
+        """Saves a shard, unless generation is given and the shard has been wiped or replaced since"""
+        data = {user_id: account.to_json() for user_id, account in accounts.items()}
+        path = self._shard_path(server_id)
+        with self._save_lock:
+            if generation is not None and generation != self._generations.get(server_id, 0):
+                return
+            with self.metrics.measure("save") as call:
+                dataIO.save_json(path, data)
+                call.nbytes = os.path.getsize(path)
+
+    def _split_json(self, json_path):
+        legacy = {}
+        for key, value in dataIO.load_json(json_path).items():
+            if "balance" in value:
+                legacy[key] = value
+            else:
+                dataIO.save_json(self._shard_path(key), value)
+        dataIO.save_json(os.path.join(self.directory, "legacy.json"), legacy)
+
+
+class AccountColumns:
+    """Accounts of one server kept column by column in typed arrays.
+
+    Rows are sorted by user id, so lookups are a bisection and no per-account
+    Python object is kept around."""
+
+    def __init__(self):
+        self.ids = array("q")
+        self.balances = array("q")
+        self.created = array("q")
+        self.names = array("I")  # Positions in the bank's name table
+
+    def __len__(self):
+        return len(self.ids)
+
+    def find(self, user_id):
+        """Row of user_id, or -1"""
+        row = bisect_left(self.ids, user_id)
+        if row < len(self.ids) and self.ids[row] == user_id:
+            return row
+        return -1
+
+    def put(self, user_id, name, balance, created):
+        """Inserts or replaces a row and returns the (name, balance, created) it replaced
+
+        Values that don't fit their column raise before any column changes."""
+        array("q", (user_id, balance, created))
+        array("I", (name,))
+        row = bisect_left(self.ids, user_id)
+        if row < len(self.ids) and self.ids[row] == user_id:
+            old = (self.names[row], self.balances[row], self.created[row])
+            self.names[row] = name
+            self.balances[row] = balance
+            self.created[row] = created
+            return old
+        self.ids.insert(row, user_id)
+        self.balances.insert(row, balance)
+        self.created.insert(row, created)
+        self.names.insert(row, name)
+        return None
+
+    def remove(self, user_id):
+        row = self.find(user_id)
+        if row >= 0:
+            for column in (self.ids, self.balances, self.created, self.names):
+                del column[row]
+
+    def copy(self):
+        columns = AccountColumns()
+        columns.ids = self.ids[:]
+        columns.balances = self.balances[:]
+        columns.created = self.created[:]
+        columns.names = self.names[:]
+        return columns
+
+    def top_rows(self, top):
+        """Rows of the top balances, ordered like the other leaderboards"""
+        if not self.ids or top <= 0:
             return []
+        if numpy is not None:
+            balances = numpy.frombuffer(self.balances, dtype=numpy.int64)
+            threshold = numpy.partition(balances, len(balances) - min(top, len(balances)))[-min(top, len(balances))]
+            rows = numpy.flatnonzero(balances >= threshold).tolist()
+        else:
+            threshold = nlargest(top, self.balances)[-1]
+            rows = list(compress(range(len(self.ids)), map(threshold.__le__, self.balances)))
+        rows.sort(key=lambda row: (-self.balances[row], str(self.ids[row])))
+        return rows[:top]
+
+    def rank(self, row):
+        balance = self.balances[row]
+        user_id = str(self.ids[row])
+        if numpy is not None:
+            ahead = int(numpy.count_nonzero(numpy.frombuffer(self.balances, dtype=numpy.int64) > balance))
+        else:
+            ahead = sum(map(balance.__lt__, self.balances))
+        ties = compress(range(len(self.ids)), map(balance.__eq__, self.balances))
+        return ahead + sum(1 for other in ties if str(self.ids[other]) < user_id) + 1
+
+
+class ColumnarBank(BaseBank):
+    """Bank held in typed arrays instead of account records.
+
+    Balances, creation times and name positions take 28 bytes per account,
+    names are shared through one table, and totals, medians and leaderboards
+    run over whole columns (with NumPy when it's installed). Saved to the
+    binary snapshot, which is created from json_path if it doesn't exist."""
+
+    def __init__(self, bot, file_path, *, json_path=None, write_behind=False):
+        super().__init__(bot)
+        self.file_path = file_path
+        self.write_behind = write_behind
+        self.dirty = False
+        self.servers = {}
+        self.names = []
+        self._name_index = {}
+        self.legacy_accounts = {}
+        self._save_lock = threading.Lock()
+        self._taken = 0  # Snapshots numbered in the order they were taken
+        self._written = 0  # Number of the newest snapshot on disk
+        with self.metrics.measure("load"):
+            if os.path.exists(file_path):
+                self._read()
+            else:
+                if json_path is not None and dataIO.is_valid_json(json_path):
+                    accounts, self.legacy_accounts = read_json_snapshot(json_path)
+                    self._fill(account for server_accounts in accounts.values()
+                               for account in server_accounts.values())
+                self._save_bank()
 
-    def get_all_accounts(self):
+    def account_exists(self, user):
+        columns = self.servers.get(user.server.id)
+        return columns is not None and columns.find(int(user.id)) >= 0
+
+    def iter_accounts(self, server=None):
+        if server is not None:
+            servers = [(server.id, self.servers.get(server.id))]
+        else:
+            servers = list(self.servers.items())
+        for server_id, columns in servers:
+            if columns is not None:
+                columns = columns.copy()
+                for row in range(len(columns)):
+                    yield self._account(server_id, columns, row)
+
+    def load_accounts(self, accounts):
+        self.servers = {}
+        self.names = []
+        self._name_index = {}
+        self._fill(accounts)
+        self._save_bank()
+
+    def wipe_bank(self, server):
+        self._record_wipe(server)
+        self.servers.pop(server.id, None)
+        self._persist()
+
+    @measured("leaderboard")
+    def get_leaderboard(self, server=None, top=10):
+        if server is not None:
+            columns = self.servers.get(server.id)
+            if columns is None:
+                return []
+            return [self._account(server.id, columns, row) for row in columns.top_rows(top)]
+        # A user's best entry can't be below the top of its own server
+        candidates = []
+        for server_id, columns in self.servers.items():
+            if self.bot.get_server(server_id) is None:  # Servers that have since been left will be ignored
+                continue
+            candidates.extend(self._account(server_id, columns, row) for row in columns.top_rows(top))
+        candidates.sort(key=lambda acc: (-acc.balance, acc.id))
         accounts = []
-        for server_id, v in self.accounts.items():
-            server = self.bot.get_server(server_id)
-            if server is None:  # Servers that have since been left will be ignored
-                continue      # Same for users_id from the old bank format
-            raw_server_accounts = deepcopy(self.accounts[server.id])
-            for k, v in raw_server_accounts.items():
-                v["id"] = k
-                v["server"] = server
-                acc = self._create_account_obj(v)
-                accounts.append(acc)
+        seen = set()
+        for account in candidates:
+            if len(accounts) >= top:
+                break
+            if account.id not in seen:
+                seen.add(account.id)
+                accounts.append(account)
         return accounts
 
-    def get_balance(self, user):
-        account = self._get_account(user)
-        return account["balance"]
+    def get_rank(self, user, *, global_rank=False):
+        if not global_rank:
+            columns = self.servers.get(user.server.id)
+            row = columns.find(int(user.id)) if columns is not None else -1
+            return columns.rank(row) if row >= 0 else None
+        best = {}
+        for columns in self.servers.values():
+            for user_id, balance in zip(columns.ids, columns.balances):
+                if best.get(user_id, -1) < balance:
+                    best[user_id] = balance
+        key = int(user.id)
+        if key not in best:
+            return None
+        balance = best[key]
+        return 1 + sum(1 for user_id, other in best.items()
+                       if other > balance or (other == balance and str(user_id) < user.id))
+
+    def total_supply(self, server=None):
+        return sum(self._balances(server))
+
+    def median_balance(self, server=None):
+        balances = self._balances(server)
+        if not balances:
+            return None
+        if numpy is not None:
+            return float(numpy.median(numpy.frombuffer(balances, dtype=numpy.int64)))
+        return statistics.median(balances)
+
+    def count_accounts(self):
+        return sum(len(columns) for columns in self.servers.values())
+
+    async def flush(self):
+        """Writes pending changes to disk from a worker thread"""
+        if not self.dirty:
+            return
+        self.dirty = False
+        data = self._snapshot()
+        self._taken += 1
+        try:
+            await self.bot.loop.run_in_executor(None, self._write, data, self._taken)
+        except Exception:
+            self.dirty = True
+            raise
 
-    def get_account(self, user):
-        acc = self._get_account(user)
-        acc["id"] = user.id
-        acc["server"] = user.server
-        return self._create_account_obj(acc)
-
-    def _create_account_obj(self, account):
-        account["member"] = account["server"].get_member(account["id"])
-        account["created_at"] = datetime.strptime(account["created_at"],
-                                                  "%Y-%m-%d %H:%M:%S")
-        Account = namedtuple("Account", "id name balance "
-                                        "created_at server member")
-        return Account(**account)
+    def close(self):
+        if self.dirty:
+            self._save_bank()
+
+    def _get_account(self, user):
+        columns = self.servers.get(user.server.id)
+        row = columns.find(int(user.id)) if columns is not None else -1
+        if row < 0:
+            raise NoAccount()
+        return self._account(user.server.id, columns, row)
+
+    def _store(self, accounts):
+        previous = []
+        try:
+            for account in accounts:
+                columns = self.servers.get(account.server_id)
+                if columns is None:
+                    columns = self.servers[account.server_id] = AccountColumns()
+                user_id = int(account.id)
+                previous.append((columns, user_id, columns.put(user_id, self._intern(account.name),
+                                                               int(account.balance), account.created)))
+            self._persist()
+        except Exception:
+            for columns, user_id, old in reversed(previous):
+                if old is None:
+                    columns.remove(user_id)
+                else:
+                    columns.put(user_id, *old)
+            raise
+
+    def _legacy_balance(self, user_id):
+        if user_id in self.legacy_accounts:
+            return int(self.legacy_accounts[user_id]["balance"])
+        return None
+
+    def _account(self, server_id, columns, row):
+        return Account(str(columns.ids[row]), server_id, self.names[columns.names[row]],
+                       columns.balances[row], columns.created[row], self.bot)
+
+    def _balances(self, server):
+        if server is not None:
+            columns = self.servers.get(server.id)
+            return columns.balances if columns is not None else array("q")
+        balances = array("q")
+        for columns in self.servers.values():
+            balances.extend(columns.balances)
+        return balances
+
+    def _intern(self, name):
+        index = self._name_index.get(name)
+        if index is None:
+            index = self._name_index[name] = len(self.names)
+            self.names.append(name)
+        return index
+
+    def _fill(self, accounts):
+        rows = defaultdict(list)
+        for account in accounts:
+            rows[account.server_id].append((int(account.id), self._intern(account.name),
+                                            int(account.balance), account.created))
+        for server_id, server_rows in rows.items():
+            self.servers[server_id] = self._columns(server_rows)
+
+    @staticmethod
+    def _columns(rows):
+        rows.sort()
+        columns = AccountColumns()
+        if rows:
+            ids, names, balances, created = zip(*rows)
+            columns.ids.extend(ids)
+            columns.names.extend(names)
+            columns.balances.extend(balances)
+            columns.created.extend(created)
+        return columns
+
+    def _read(self):
+        ids, snapshot, name_table, self.legacy_accounts = read_snapshot_columns(self.file_path)
+        servers, users, balances, created, offsets = snapshot
+        names = {}
+        rows = defaultdict(list)
+        for server, user, balance, created_at, offset in zip(servers, users, balances, created, offsets):
+            name = names.get(offset)
+            if name is None:
+                name = names[offset] = self._intern(name_table[offset:name_table.index(b"\0", offset)].decode("utf-8"))
+            rows[server].append((int(ids[user]), name, balance, created_at))
+        for server, server_rows in rows.items():
+            self.servers[ids[server]] = self._columns(server_rows)
+
+    def _persist(self):
+        if self.write_behind:
+            self.dirty = True
+        else:
+            self._save_bank()
 
     def _save_bank(self):
-        dataIO.save_json("data/economy/bank.json", self.accounts)
+        self.dirty = False
+        self._taken += 1
+        self._write(self._snapshot(), self._taken)
+
+    def _snapshot(self):
+        """Copies of the columns, so they can be saved from another thread"""
+        return [(server_id, columns.copy()) for server_id, columns in self.servers.items()], list(self.names)
+
+    def _write(self, snapshot, number=None):
+        """Saves a snapshot, unless number is given and a newer snapshot has been saved already"""
+        servers, names = snapshot
+        name_table = bytearray()
+        name_offsets = array("I")
+        for name in names:
+            name_offsets.append(len(name_table))
+            name_table += name.replace("\0", "").encode("utf-8") + b"\0"
+        ids = []
+        columns = [array(typecode) for typecode in SNAPSHOT_COLUMNS]
+        server_column, user_column, balance_column, created_column, offset_column = columns
+        for server_id, server_columns in servers:
+            server_column.extend(array("I", [len(ids)]) * len(server_columns))
+            ids.append(server_id)
+            user_column.extend(range(len(ids), len(ids) + len(server_columns)))
+            ids.extend(str(user_id) for user_id in server_columns.ids)
+            balance_column.extend(server_columns.balances)
+            created_column.extend(server_columns.created)
+            offset_column.extend(name_offsets[name] for name in server_columns.names)
+        with self._save_lock:
+            if number is not None and number < self._written:
+                return
+            with self.metrics.measure("save") as call:
+                write_snapshot_columns(self.file_path, ids, columns, name_table, self.legacy_accounts)
+                call.nbytes = os.path.getsize(self.file_path)
+            if number is not None:
+                self._written = number
+
+
+def open_bank(bot, storage):
+    if storage["SERVICE"]:
+        return RemoteBank(bot, storage["SERVICE"])
+    if storage["BACKEND"] == "sqlite":
+        bank = SQLiteBank(bot, "data/economy/bank.db", json_path="data/economy/bank.json")
+    elif storage["BACKEND"] == "sharded":
+        bank = ShardedBank(bot, "data/economy/bank", json_path="data/economy/bank.json",
+                           write_behind=storage["WRITE_BEHIND"], idle=storage["SHARD_IDLE"])
+    elif storage["BACKEND"] == "columnar":
+        bank = ColumnarBank(bot, "data/economy/bank.bin", json_path="data/economy/bank.json",
+                            write_behind=storage["WRITE_BEHIND"])
+    else:
+        file_path = "data/economy/bank.bin" if storage["SNAPSHOT"] == "binary" else "data/economy/bank.json"
+        bank = Bank(bot, file_path, json_path="data/economy/bank.json",
+                    journal=storage["JOURNAL"], fsync=storage["JOURNAL_FSYNC"],
+                    write_behind=storage["WRITE_BEHIND"])
+    if storage["LEDGER"]:
+        bank.ledger = BankLedger(LEDGER_PATH)
+    return bank
+
+
+class BankConnection:
+    """Blocking connection to a bank service
+
+    Connecting and every read give up after timeout seconds, and socket
+    errors are raised as ServiceUnavailable."""
+
+    def __init__(self, address, timeout=SERVICE_TIMEOUT):
+        kind, target = parse_address(address)
+        try:
+            if kind == "unix":
+                self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                self.sock.settimeout(timeout)
+                self.sock.connect(target)
+            else:
+                self.sock = socket.create_connection(target, timeout)
+                self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        except OSError as e:
+            raise ServiceUnavailable("Could not connect to the bank service at {}: {}".format(address, e))
+        self.reader = self.sock.makefile("rb")
+        self.next_id = 0
+
+    def request(self, calls):
+        """Sends every (method, args) pair at once, then reads the replies in order"""
+        try:
+            return self._request(calls)
+        except OSError as e:  # Timeouts and resets; ConnectionError is one too
+            raise ServiceUnavailable("The bank service did not answer: {}".format(e))
+
+    def stream(self, method, args):
+        """Sends one request and yields the chunks of its result as they arrive"""
+        try:
+            request_id, = self._send([(method, args)])
+            for reply in self._replies(request_id):
+                if "error" in reply:
+                    raise BANK_ERRORS.get(reply["error"], BankError)(reply.get("message", ""))
+                yield reply["result"]
+        except OSError as e:
+            raise ServiceUnavailable("The bank service did not answer: {}".format(e))
+
+    def _send(self, calls):
+        ids = []
+        data = []
+        for method, args in calls:
+            self.next_id += 1
+            ids.append(self.next_id)
+            data.append(json.dumps({"id" : self.next_id, "method" : method, "args" : args},
+                                   separators=(",", ":")))
+        self.sock.sendall(("\n".join(data) + "\n").encode("utf-8"))
+        return ids
+
+    def _replies(self, request_id):
+        """Yields the lines of one reply; long results come in several"""
+        while True:
+            line = self.reader.readline()
+            if not line:
+                raise ConnectionError("The bank service closed the connection")
+            reply = json.loads(line.decode("utf-8"))
+            if reply["id"] != request_id:
+                raise ConnectionError("Out of order reply from the bank service")
+            yield reply
+            if not reply.get("more"):
+                return
+
+    def _request(self, calls):
+        replies = []
+        for request_id in self._send(calls):
+            result = []
+            for reply in self._replies(request_id):
+                if reply.get("more"):
+                    result.extend(reply["result"])  # Streamed in chunks
+            if "error" in reply:
+                replies.append(BANK_ERRORS.get(reply["error"], BankError)(reply.get("message", "")))
+            elif result:
+                replies.append(result + reply["result"])
+            else:
+                replies.append(reply["result"])
+        return replies
+
+    def close(self):
+        self.reader.close()
+        self.sock.close()
+
+
+class BankPipeline:
+    """Requests queued up and sent to the bank service in one write"""
+
+    def __init__(self, bank):
+        self.bank = bank
+        self.calls = []
+
+    def call(self, method, *args):
+        self.calls.append((method, list(args)))
+
+    def execute(self):
+        """Returns every result in order; failed requests give their exception"""
+        calls, self.calls = self.calls, []
+        if not calls:
+            return []
+        connection = self.bank.pool.acquire()
+        try:
+            replies = connection.request(calls)
+        except Exception:
+            connection.close()
+            raise
+        self.bank.pool.release(connection)
+        return replies
+
+
+class ConnectionPool:
+    def __init__(self, address, size=4):
+        self.address = address
+        self.size = size
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        return BankConnection(self.address)
+
+    def release(self, connection):
+        with self._lock:
+            if len(self._idle) < self.size:
+                self._idle.append(connection)
+                return
+        connection.close()
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for connection in idle:
+            connection.close()
+
+
+class RemoteBank(BaseBank):
+    """Client of a bank running as its own process (see bankd.py).
+
+    Every bot process pointed at the same service shares one set of
+    balances. Changes are validated and applied by the service one request
+    at a time, so they stay atomic across processes. Requests go through a
+    small pool of connections, and pipeline() sends several at once."""
+
+    def __init__(self, bot, address, *, pool_size=4):
+        super().__init__(bot)
+        self.address = address
+        self.pool = ConnectionPool(address, pool_size)
+
+    def call(self, method, *args):
+        pipeline = self.pipeline()
+        pipeline.call(method, *args)
+        result = pipeline.execute()[0]
+        if isinstance(result, BankError):
+            raise result
+        return result
+
+    def pipeline(self):
+        return BankPipeline(self)
+
+    async def offload(self, func, *args, **kwargs):
+        return await self.bot.loop.run_in_executor(None, partial(func, *args, **kwargs))
+
+    @measured("create")
+    def create_account(self, user, *, initial_balance=0):
+        return wire_account(self.call("create_account", user.server.id, user.id, user.name, initial_balance), self.bot)
+
+    def account_exists(self, user):
+        return self.call("account_exists", user.server.id, user.id)
+
+    def iter_accounts(self, server=None):
+        connection = self.pool.acquire()
+        try:
+            for rows in connection.stream("iter_accounts", [server.id if server is not None else None]):
+                for row in rows:
+                    yield wire_account(row, self.bot)
+        except BaseException:  # Also when the caller stops early, with the rest of the reply still coming
+            connection.close()
+            raise
+        self.pool.release(connection)
+
+    def load_accounts(self, accounts):
+        self.call("load_accounts", [account_wire(account) for account in accounts])
+
+    def wipe_bank(self, server):
+        self.call("wipe_bank", server.id)
+
+    @measured("bulk")
+    def bulk_apply(self, server, *, delta=None, value=None, predicate=None):
+        user_ids = None
+        if predicate is not None:  # Can't be sent over, so it picks the accounts here
+            user_ids = [account.id for account in self.iter_accounts(server) if predicate(account)]
+        return [wire_account(row, self.bot) for row in self.call("bulk_apply", server.id, delta, value, user_ids)]
+
+    @measured("leaderboard")
+    def get_leaderboard(self, server=None, top=10):
+        return [wire_account(row, self.bot) for row in
+                self.call("get_leaderboard", server.id if server is not None else None, top)]
+
+    def get_rank(self, user, *, global_rank=False):
+        return self.call("get_rank", user.server.id, user.id, global_rank)
+
+    def total_supply(self, server=None):
+        return self.call("total_supply", server.id if server is not None else None)
+
+    def median_balance(self, server=None):
+        return self.call("median_balance", server.id if server is not None else None)
+
+    def count_accounts(self):
+        return self.call("count_accounts")
+
+    def history(self, user, page=1, per_page=10):
+        entries, total = self.call("history", user.server.id, user.id, page, per_page)
+        return [tuple(entry) for entry in entries], total
+
+    def verify_ledger(self):
+        mismatches, broken = self.call("verify_ledger")
+        return [tuple(row) for row in mismatches], [tuple(key) for key in broken]
+
+    def rebuild_from_ledger(self):
+        return [wire_account(row, self.bot) for row in self.call("rebuild_from_ledger")]
+
+    def stats(self):
+        stats = self.metrics.snapshot()
+        stats["backend"] = "RemoteBank ({})".format(self.address)
+        stats["accounts"] = self.count_accounts()
+        return stats
+
+    def close(self):
+        self.pool.close()
+
+    def _commit(self, operations):
+        # Holds are kept by each bot process, so they're sent along and checked
+        # by the service in the same request that changes the balances
+        held = {}
+        for op, user, amount in operations:
+            if op in ("withdraw", "transfer_out"):
+                held[(user.server.id, user.id)] = self.holds.held(user.server.id, user.id)
+        self.call("commit", [[op, user.server.id, user.id, amount] for op, user, amount in operations],
+                  [[server_id, user_id, amount] for (server_id, user_id), amount in held.items() if amount])
 
     def _get_account(self, user):
-        server = user.server
+        return wire_account(self.call("get_account", user.server.id, user.id), self.bot)
+
+
+class RemoteServer:
+    def __init__(self, server_id):
+        self.id = server_id
+
+
+class RemoteUser:
+    """Stands in for a member sent over by a bank service client"""
+
+    def __init__(self, server_id, user_id, name=None):
+        self.id = user_id
+        self.name = name
+        self.server = RemoteServer(server_id)
+
+
+class ServiceBot:
+    """Stands in for the bot inside the bank service.
+
+    The service can't know which servers each client still is in, so every
+    server counts as joined."""
+
+    def __init__(self, loop):
+        self.loop = loop
+
+    def get_server(self, server_id):
+        return RemoteServer(server_id)
+
+
+class BankServer:
+    """Serves a bank to RemoteBank clients, one request at a time"""
+
+    chunk = 1000  # Accounts per line when streaming long results
+
+    def __init__(self, bank):
+        self.bank = bank
+
+    async def handle(self, reader, writer):
         try:
-            return deepcopy(self.accounts[server.id][user.id])
-        except KeyError:
-            raise NoAccount()
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                request = json.loads(line.decode("utf-8"))
+                for reply in self.dispatch(request):
+                    writer.write(json.dumps(reply, separators=(",", ":")).encode("utf-8") + b"\n")
+                    await writer.drain()  # Long results go out chunk by chunk instead of piling up
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    def dispatch(self, request):
+        handler = getattr(self, "_" + request["method"], None)
+        try:
+            if handler is None:
+                raise BankError("Unknown method {}".format(request["method"]))
+            result = handler(*request["args"])
+        except BankError as e:
+            yield {"id" : request["id"], "error" : type(e).__name__, "message" : str(e)}
+            return
+        except Exception as e:  # Bad arguments shouldn't take the connection down
+            yield {"id" : request["id"], "error" : "BankError", "message" : "{}: {}".format(type(e).__name__, e)}
+            return
+        if request["method"] == "iter_accounts":
+            rows = []
+            for row in result:
+                rows.append(row)
+                if len(rows) == self.chunk:
+                    yield {"id" : request["id"], "result" : rows, "more" : True}
+                    rows = []
+            result = rows
+        yield {"id" : request["id"], "result" : result}
+
+    def _server(self, server_id):
+        return RemoteServer(server_id) if server_id is not None else None
+
+    def _create_account(self, server_id, user_id, name, initial_balance):
+        return account_wire(self.bank.create_account(RemoteUser(server_id, user_id, name),
+                                                      initial_balance=initial_balance))
+
+    def _account_exists(self, server_id, user_id):
+        return self.bank.account_exists(RemoteUser(server_id, user_id))
+
+    def _get_account(self, server_id, user_id):
+        return account_wire(self.bank.get_account(RemoteUser(server_id, user_id)))
+
+    def _iter_accounts(self, server_id):
+        return (account_wire(account) for account in self.bank.iter_accounts(self._server(server_id)))
 
+    def _load_accounts(self, rows):
+        self.bank.load_accounts(wire_account(row, self.bank.bot) for row in rows)
+
+    def _wipe_bank(self, server_id):
+        self.bank.wipe_bank(RemoteServer(server_id))
+
+    def _commit(self, operations, held=()):
+        self.bank._commit([(op, RemoteUser(server_id, user_id), amount)
+                           for op, server_id, user_id, amount in operations],
+                          {(server_id, user_id): amount for server_id, user_id, amount in held})
+
+    def _bulk_apply(self, server_id, delta, value, user_ids):
+        predicate = None
+        if user_ids is not None:
+            user_ids = set(user_ids)
+            predicate = lambda account: account.id in user_ids
+        return [account_wire(account) for account in
+                self.bank.bulk_apply(RemoteServer(server_id), delta=delta, value=value, predicate=predicate)]
+
+    def _get_leaderboard(self, server_id, top):
+        return [account_wire(account) for account in self.bank.get_leaderboard(self._server(server_id), top)]
+
+    def _get_rank(self, server_id, user_id, global_rank):
+        return self.bank.get_rank(RemoteUser(server_id, user_id), global_rank=global_rank)
+
+    def _total_supply(self, server_id):
+        return self.bank.total_supply(self._server(server_id))
+
+    def _median_balance(self, server_id):
+        return self.bank.median_balance(self._server(server_id))
+
+    def _count_accounts(self):
+        return self.bank.count_accounts()
+
+    def _history(self, server_id, user_id, page, per_page):
+        return self.bank.history(RemoteUser(server_id, user_id), page, per_page)
+
+    def _verify_ledger(self):
+        return self.bank.verify_ledger()
+
+    def _rebuild_from_ledger(self):
+        return [account_wire(account) for account in self.bank.rebuild_from_ledger()]
+
+
+BANK_ERRORS = {error.__name__: error for error in (BankError, ServiceUnavailable, AccountAlreadyExists, NoAccount,
+                                                   InsufficientBalance, NegativeValue, SameSenderAndReceiver,
+                                                   UnknownHold, BalanceTooLarge)}
+
+
+def account_wire(account):
+    return [account.id, account.server_id, account.name, account.balance, account.created]
+
+
+def wire_account(row, bot=None):
+    user_id, server_id, name, balance, created = row
+    return Account(user_id, server_id, name, balance, created, bot)
+
+
+def is_loopback(host):
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+def parse_address(address):
+    """Splits unix:<path> or tcp:<host>:<port> into a kind and a connect target"""
+    kind, sep, target = address.partition(":")
+    if kind == "unix" and sep:
+        return "unix", target
+    if kind == "tcp" and sep:
+        host, sep, port = target.rpartition(":")
+        if sep and port.isdigit():
+            host = host.strip("[]") or "127.0.0.1"
+            if not is_loopback(host):  # The service has no authentication
+                raise ValueError("The bank service can only use loopback addresses, not {}".format(host))
+            return "tcp", (host, int(port))
+    raise ValueError("Bank service addresses look like unix:<path> or tcp:<host>:<port>, not {}".format(address))
+
+
+async def serve_bank(storage, address):
+    """Runs the bank configured in storage as a service until cancelled"""
+    loop = asyncio.get_event_loop()
+    bank = open_bank(ServiceBot(loop), dict(storage, SERVICE=None))
+    server = BankServer(bank)
+    kind, target = parse_address(address)
+    if kind == "unix":
+        if os.path.exists(target):
+            os.remove(target)
+        listener = await asyncio.start_unix_server(server.handle, target)
+    else:
+        listener = await asyncio.start_server(server.handle, *target)
+    try:
+        compacted = time.time()
+        while True:
+            await asyncio.sleep(storage["FLUSH_INTERVAL"])
+            await bank.flush()
+            bank.release_idle()
+            if bank.journal is not None and time.time() - compacted >= storage["COMPACT_INTERVAL"]:
+                await bank.compact_async()
+                compacted = time.time()
+    finally:
+        listener.close()
+        await listener.wait_closed()
+        bank.close()
+        if kind == "unix" and os.path.exists(target):
+            os.remove(target)
 
 class Economy:
     """Economy
@@ -191,15 +2900,67 @@ class Economy:
     def __init__(self, bot):
         global default_settings
         self.bot = bot
-        self.bank = Bank(bot, "data/economy/bank.json")
+        self.storage_file_path = "data/economy/storage.json"
+        self.storage = dict(default_storage)
+        self.storage.update(dataIO.load_json(self.storage_file_path))
+        self.bank = open_bank(bot, self.storage)
+        self.bank.holds = HoldRegistry(HOLDS_PATH)
+        for hold in self.bank.holds.recovered:
+            print("Economy: released {amount} credits held for {tag} by user {user} "
+                  "on server {server}".format(**hold))
         self.file_path = "data/economy/settings.json"
         self.settings = dataIO.load_json(self.file_path)
         if "PAYDAY_TIME" in self.settings:  # old format
             default_settings = self.settings
             self.settings = {}
         self.settings = defaultdict(lambda: default_settings, self.settings)
-        self.payday_register = defaultdict(dict)
-        self.slot_register = defaultdict(dict)
+        self.payday_register = CooldownRegistry("data/economy/cooldowns.json",
+                                                lambda server_id: self.settings[server_id]["PAYDAY_TIME"])
+        self.compact_task = bot.loop.create_task(self.compact_journal())
+        self.flush_task = bot.loop.create_task(self.flush_bank())
+        self.cooldown_task = bot.loop.create_task(self.save_cooldowns())
+        atexit.register(self.bank.close)
+        atexit.register(self.payday_register.save)
+        atexit.register(self.bank.holds.save)
+
+    def __unload(self):
+        self.compact_task.cancel()
+        self.flush_task.cancel()
+        self.cooldown_task.cancel()
+        atexit.unregister(self.bank.close)
+        atexit.unregister(self.payday_register.save)
+        atexit.unregister(self.bank.holds.save)
+        self.bank.close()
+        if self.bank.ledger is not None:
+            self.bank.ledger.close()
+        self.payday_register.save()
+        self.bank.holds.save()
+
+    async def compact_journal(self):
+        while self == self.bot.get_cog("Economy"):
+            await asyncio.sleep(self.storage["COMPACT_INTERVAL"])
+            if self.bank.journal is not None and self.bank.journal.size:
+                await self.bank.compact_async()
+
+    async def flush_bank(self):
+        while self == self.bot.get_cog("Economy"):
+            await asyncio.sleep(self.storage["FLUSH_INTERVAL"])
+            try:
+                await self.bank.flush()
+            except Exception as e:
+                print("Economy: failed to save the bank ({}), retrying later".format(e))
+            self.bank.release_idle()
+
+    async def save_cooldowns(self):
+        while self == self.bot.get_cog("Economy"):
+            await asyncio.sleep(COOLDOWN_SAVE_INTERVAL)
+            self.payday_register.sweep()
+            if self.payday_register.dirty:
+                self.payday_register.save()
+            if self.bank.holds.dirty:
+                self.bank.holds.save()
+            if self.bank.ledger is not None and self.bank.ledger.dirty:
+                self.bank.ledger.save_index()
 
     @commands.group(name="bank", pass_context=True)
     async def _bank(self, ctx):
@@ -212,7 +2973,7 @@ class Economy:
         """Registers an account at the bank"""
         user = ctx.message.author
         try:
-            account = self.bank.create_account(user)
+            account = await self.bank.offload(self.bank.create_account, user)
             await self.bot.say("{}\n```css\nAccount opened. Current balance: {}\n"
                                "Remember to periodically type {}payday to get free credits.\n```".format(user.mention,
                                                                                                          account.balance,ctx.prefix))
@@ -232,12 +2993,14 @@ class Economy:
         if not user:
             user = ctx.message.author
             try:
-                await self.bot.say("{}\n```css\nYour balance is: {}\n```".format(user.mention, self.bank.get_balance(user)))
+                balance = await self.bank.offload(self.bank.get_balance, user)
+                await self.bot.say("{}\n```css\nYour balance is: {}\n```".format(user.mention, balance))
             except NoAccount:
                 await ctx.invoke(self.register)
         else:
             try:
-                await self.bot.say("```css\n{}'s balance is {}```".format(user.name, self.bank.get_balance(user)))
+                balance = await self.bank.offload(self.bank.get_balance, user)
+                await self.bot.say("```css\n{}'s balance is {}```".format(user.name, balance))
             except NoAccount:
                 await self.bot.say("```css\n{} does not have an account registered with the bank.\n```".format(user.name))
 
@@ -250,23 +3013,68 @@ class Economy:
         else:
             await ctx.invoke(self.balance, user)
 
+    @_bank.command(pass_context=True, no_pm=True)
+    async def supply(self, ctx):
+        """Shows how many credits exist on this server"""
+        server = ctx.message.server
+        total = await self.bank.offload(self.bank.total_supply, server)
+        median = await self.bank.offload(self.bank.median_balance, server)
+        if median is None:
+            await self.bot.say("```css\nNobody on this server has a bank account yet.\n```")
+            return
+        await self.bot.say("```css\n{} credits are held on this server. The median balance is {:g}.\n```".format(total, median))
+
+    @_bank.command(pass_context=True, no_pm=True)
+    async def history(self, ctx, user : discord.Member=None, page : int=1):
+        """Shows a page of bank account history
+        Defaults to yours."""
+        if not user:
+            user = ctx.message.author
+        if page < 1:
+            page = 1
+        try:
+            entries, total = await self.bank.offload(self.bank.history, user, page, HISTORY_PAGE_SIZE)
+        except ServiceUnavailable:
+            raise
+        except BankError:
+            await self.bot.say("```css\nThe bank ledger is disabled.\n```")
+            return
+        if not total:
+            await self.bot.say("```css\n{} has no bank history.\n```".format(user.name))
+            return
+        pages = -(-total // HISTORY_PAGE_SIZE)
+        if not entries:
+            await self.bot.say("```css\n{} only has {} pages of history.\n```".format(user.name, pages))
+            return
+        msg = "{}'s history, page {} of {}\n".format(user.name, page, pages)
+        for timestamp, op, change, balance in entries:
+            msg += "{} {:<13}{:>+12}{:>12}\n".format(time.strftime("[%d/%m/%Y %H:%M]", time.localtime(timestamp)),
+                                                   op.replace("_", " "), change, balance)
+        await self.bot.say("```css\n{}```".format(msg))
+
     @_bank.command(pass_context=True)
     async def transfer(self, ctx, user : discord.Member, sum : int):
         """Transfer credits to other users."""
         author = ctx.message.author
         try:
-            self.bank.transfer_credits(author, user, sum)
+            async with self.bank.lock(author, user):
+                await self.bank.offload(self.bank.transfer_credits, author, user, sum)
             logger.info("{}({}) transferred {} credits to {}({})".format(
-                author.name, author.id, sum, user.name, user.id))
+                author.name, author.id, sum, user.name, user.id),
+                extra={"op" : "transfer", "server" : author.server.id,
+                       "user" : author.id, "target" : user.id, "amount" : sum})
             await self.bot.say("```css\n{} credits have been transferred to {}'s account.\n```".format(sum, user.name))
         except NegativeValue:
             await self.bot.say("```css\nYou need to transfer at least 1 credit.\n```")
         except SameSenderAndReceiver:
             await self.bot.say("```css\nYou can't transfer credits to yourself.\n```")
+        except BalanceTooLarge:
+            await self.bot.say("```css\n{}'s balance can't hold that many credits.\n```".format(user.name))
         except InsufficientBalance:
             await self.bot.say("```css\nYou don't have that sum in your bank account.\n```")
         except NoAccount:
-            self.bank.withdraw_credits(author,sum)
+            async with self.bank.lock(author):
+                await self.bank.offload(self.bank.withdraw_credits, author, sum)
             await ctx.invoke(self._set,user,sum)
 
     @commands.command(pass_context=True,no_pm=True,name="transfer")
@@ -283,40 +3091,167 @@ class Economy:
         """Sets credits of user's bank account.
         Owner use only."""
         author = ctx.message.author
+        if sum > MAX_BALANCE:
+            await self.bot.say("```css\nBalances can't go above {}.\n```".format(MAX_BALANCE))
+            return
         try:
-            self.bank.set_credits(user, sum)
-            logger.info("{}({}) set {} credits to {} ({})".format(author.name, author.id, str(sum), user.name, user.id))
+            async with self.bank.lock(user):
+                await self.bank.offload(self.bank.set_credits, user, sum)
+            logger.info("{}({}) set {} credits to {} ({})".format(author.name, author.id, str(sum), user.name, user.id),
+                        extra={"op" : "set", "server" : user.server.id,
+                               "user" : author.id, "target" : user.id, "amount" : sum})
             await self.bot.say("```css\n{}'s credits have been set to {}.\n```".format(user.name, str(sum)))
         except NoAccount:
-            self.bank.create_account(user)
-            self.bank.set_credits(user, sum)
-            balance = self.bank.get_balance(user)
+            async with self.bank.lock(user):
+                if not await self.bank.offload(self.bank.account_exists, user):
+                    await self.bank.offload(self.bank.create_account, user)
+                await self.bank.offload(self.bank.set_credits, user, sum)
+                balance = await self.bank.offload(self.bank.get_balance, user)
             await self.bot.say("```css\n{} had no existing account so new account opened with balance: {}\n```".format(user.name,
                                                                                                                        str(balance)))
 
+    @_bank.command(pass_context=True, no_pm=True)
+    @checks.is_owner()
+    async def bulkdeposit(self, ctx, sum : int, *filters):
+        """Adds credits to every account on this server
+
+        Negative amounts take credits away, down to 0. Filters can be a role
+        and balance conditions such as <1000 or >=500.
+        Owner use only."""
+        await self._bulk(ctx, "bulkdeposit", filters, delta=sum)
+
+    @_bank.command(pass_context=True, no_pm=True)
+    @checks.is_owner()
+    async def bulkset(self, ctx, sum : int, *filters):
+        """Sets credits of every account on this server
+
+        Filters can be a role and balance conditions such as <1000 or >=500.
+        Owner use only."""
+        await self._bulk(ctx, "bulkset", filters, value=sum)
+
+    async def _bulk(self, ctx, op, filters, *, delta=None, value=None):
+        author = ctx.message.author
+        server = ctx.message.server
+        try:
+            predicate = self._bulk_predicate(ctx, filters)
+        except ValueError as e:
+            await self.bot.say("```css\n{}\n```".format(e))
+            return
+        try:
+            async with self.bank.lock.all():
+                accounts = await self.bank.offload(self.bank.bulk_apply, server, delta=delta, value=value,
+                                                   predicate=predicate)
+        except NegativeValue:
+            await self.bot.say("```css\nCredits can't be set to a negative amount.\n```")
+            return
+        except BalanceTooLarge:
+            await self.bot.say("```css\nBalances can't go above {}.\n```".format(MAX_BALANCE))
+            return
+        amount = delta if delta is not None else value
+        logger.info("{}({}) applied {} {} to {} accounts on {} ({})".format(author.name, author.id, op, amount,
+                                                                         len(accounts), server.name, " ".join(filters) or "no filter"),
+                    extra={"op" : op, "server" : server.id, "user" : author.id, "amount" : amount})
+        await self.bot.say("```css\n{} accounts have been updated.\n```".format(len(accounts)))
+
+    def _bulk_predicate(self, ctx, filters):
+        server = ctx.message.server
+        roles = []
+        conditions = []
+        for item in filters:
+            match = re.match(r"^(<=|>=|<|>|=)(\d+)$", item)
+            if match:
+                conditions.append((BALANCE_COMPARISONS[match.group(1)], int(match.group(2))))
+                continue
+            role = next((r for r in ctx.message.role_mentions if r.mention == item), None) or \
+                   next((r for r in server.roles if r.name.lower() == item.lower()), None)
+            if role is None:
+                raise ValueError("{} is neither a role nor a balance condition.".format(item))
+            roles.append(role)
+        if not roles and not conditions:
+            return None
+
+        def predicate(account):
+            if not all(compare(account.balance, amount) for compare, amount in conditions):
+                return False
+            if roles:
+                member = server.get_member(account.id)
+                return member is not None and any(role in member.roles for role in roles)
+            return True
+        return predicate
+
     @_bank.command(name="wipe", pass_context=True, hidden=True)
     @checks.is_owner()
     async def wipe(self,ctx):
         """Wipes all bank account information stored on this server.
         Owner use only."""
-        self.bank.wipe_bank(ctx.message.server)
+        await self.bank.offload(self.bank.wipe_bank, ctx.message.server)
         await self.bot.say("```css\nWipe successful.\n```")
 
-    @_bank.command(pass_context=True,no_pm=True,name="activity",hidden=True)
+    @_bank.command(pass_context=True, name="export", hidden=True)
     @checks.is_owner()
-    async def activity(self,ctx,num:int=10):
-        """Returns recent bank activity information."""
-        log_file_path = "data/economy/economy.log"
-        log_file = open(log_file_path, "r", encoding="utf-8")
+    async def export(self, ctx, format : str="ndjson", members : str=None):
+        """Exports every bank account to a file in data/economy/exports
+
+        Formats are ndjson and csv. Add "members" to look up each account's
+        server and member names as well.
+        Owner use only."""
+        format = format.lower()
+        if format not in ("ndjson", "csv"):
+            await self.bot.say("```css\nAvailable export formats: ndjson, csv.\n```")
+            return
+        resolve = members is not None and members.lower() == "members"
+        file_path = os.path.join(EXPORT_DIR, "accounts-{}.{}".format(time.strftime("%Y%m%d-%H%M%S"), format))
+        count = await self._export(file_path, format, resolve)
+        await self.bot.say("```css\n{} accounts exported to {}.\n```".format(count, file_path))
+
+    async def _export(self, file_path, format, resolve):
+        fields = EXPORT_FIELDS + EXPORT_MEMBER_FIELDS if resolve else EXPORT_FIELDS
         count = 0
+        with open(file_path, "w", encoding="utf-8", newline="") as f:
+            if format == "csv":
+                writer = csv.writer(f)
+                writer.writerow(fields)
+            accounts = self.bank.iter_accounts()
+            while True:
+                # Fetched a chunk at a time, off the event loop for a bank service
+                chunk = await self.bank.offload(list, islice(accounts, EXPORT_CHUNK))
+                if not chunk:
+                    break
+                for account in chunk:
+                    row = [account.server_id, account.id, account.name, account.balance,
+                           time.strftime(TIMESTAMP_FORMAT, time.localtime(account.created))]
+                    if resolve:
+                        server = self.bot.get_server(account.server_id)
+                        member = server.get_member(account.id) if server is not None else None
+                        row += [server.name if server is not None else None,
+                                member.name if member is not None else None,
+                                member is not None]
+                    if format == "csv":
+                        writer.writerow(row)
+                    else:
+                        f.write(json.dumps(dict(zip(fields, row))) + "\n")
+                count += len(chunk)
+                await asyncio.sleep(0)  # Lets other commands run during big exports
+        return count
+
+    @_bank.command(pass_context=True,no_pm=True,name="activity",hidden=True)
+    @checks.is_owner()
+    async def activity(self,ctx,num:int=10,filter:str=None):
+        """Returns recent bank activity information.
+        Filter by mentioning a user or naming an operation (transfer, set)."""
+        user_id = op = None
+        if ctx.message.mentions:
+            user_id = ctx.message.mentions[0].id
+        elif filter is not None:
+            op = filter.lower()
         ls = "Activity log (descending time order)\n" \
              "==============================================================================\n"
-        for line in reversed(log_file.readlines()):
-            ls += "{}. {}\n".format(count+1, line)
-            count += 1
-            if count >= num:
-                break
-        log_file.close()
+        entries = await self.bot.loop.run_in_executor(None, lambda: recent_activity(num, user_id=user_id, op=op))
+        for count, entry in enumerate(entries):
+            if entry["time"] is None:
+                ls += "{}. {}\n".format(count+1, entry["msg"])
+            else:
+                ls += "{}. {} {}\n".format(count+1, time.strftime("[%d/%m/%Y %H:%M]", time.localtime(entry["time"])), entry["msg"])
         await self.bot.say("```css\n{}\n```".format(ls))
 
     @commands.command(pass_context=True, no_pm=True)
@@ -325,21 +3260,18 @@ class Economy:
         author = ctx.message.author
         server = author.server
         id = author.id
-        if self.bank.account_exists(author):
-            if id in self.payday_register[server.id]:
-                seconds = abs(self.payday_register[server.id][id] - int(time.perf_counter()))
-                if seconds  >= self.settings[server.id]["PAYDAY_TIME"]:
-                    self.bank.deposit_credits(author, self.settings[server.id]["PAYDAY_CREDITS"])
-                    self.payday_register[server.id][id] = int(time.perf_counter())
-                    await self.bot.say("```css\n{}, {} credits have been added to your account!\n```".format(author.name, str(self.settings[server.id]["PAYDAY_CREDITS"])))
+        async with self.bank.lock(author):  # Released before replying, so a slow send doesn't hold up other changes
+            if await self.bank.offload(self.bank.account_exists, author):
+                seconds = self.payday_register.remaining(server.id, id)
+                if seconds == 0:
+                    await self.bank.offload(self.bank.deposit_credits, author, self.settings[server.id]["PAYDAY_CREDITS"])
+                    self.payday_register.touch(server.id, id)
+                    msg = "```css\n{}, {} credits have been added to your account!\n```".format(author.name, str(self.settings[server.id]["PAYDAY_CREDITS"]))
                 else:
-                    await self.bot.say("{}\n```css\nToo soon. For your next payday you have to wait {}.\n```".format(author.mention, self.display_time(self.settings[server.id]["PAYDAY_TIME"] - seconds)))
+                    msg = "{}\n```css\nToo soon. For your next payday you have to wait {}.\n```".format(author.mention, self.display_time(seconds))
             else:
-                self.payday_register[server.id][id] = int(time.perf_counter())
-                self.bank.deposit_credits(author, self.settings[server.id]["PAYDAY_CREDITS"])
-                await self.bot.say("```css\n{}, {} credits have been added to your account!\n```".format(author.name, str(self.settings[server.id]["PAYDAY_CREDITS"])))
-        else:
-            await self.bot.say("{}\n```css\nYou need an account to receive credits. Type '{}bank register' to open one.\n```".format(author.mention, ctx.prefix))
+                msg = "{}\n```css\nYou need an account to receive credits. Type '{}bank register' to open one.\n```".format(author.mention, ctx.prefix)
+        await self.bot.say(msg)
 
     @commands.group(pass_context=True)
     async def leaderboard(self, ctx):
@@ -355,11 +3287,9 @@ class Economy:
         server = ctx.message.server
         if top < 1:
             top = 10
-        bank_sorted = sorted(self.bank.get_server_accounts(server),
-                             key=lambda x: x.balance, reverse=True)
-        if len(bank_sorted) < top:
-            top = len(bank_sorted)
-        topten = bank_sorted[:top]
+        topten = await self.bank.offload(self.bank.get_leaderboard, server, top)
+        if len(topten) < top:
+            top = len(topten)
         highscore = ""
         place = 1
         for acc in topten:
@@ -383,20 +3313,15 @@ class Economy:
         Defaults to top 10"""
         if top < 1:
             top = 10
-        bank_sorted = sorted(self.bank.get_all_accounts(),
-                             key=lambda x: x.balance, reverse=True)
-        unique_accounts = []
-        for acc in bank_sorted:
-            if not self.already_in_list(unique_accounts, acc):
-                unique_accounts.append(acc)
-        if len(unique_accounts) < top:
-            top = len(unique_accounts)
-        topten = unique_accounts[:top]
+        topten = await self.bank.offload(self.bank.get_leaderboard, None, top)
+        if len(topten) < top:
+            top = len(topten)
         highscore = ""
         place = 1
         for acc in topten:
+            server = self.bot.get_server(acc.server_id)  # Unknown when the bank is shared with other bot processes
             highscore += str(place).ljust(len(str(top))+1)
-            highscore += ("{} |{}| ".format(acc.name, acc.server.name)).ljust(23-len(str(acc.balance)))
+            highscore += ("{} |{}| ".format(acc.name, server.name if server is not None else acc.server_id)).ljust(23-len(str(acc.balance)))
             highscore += str(acc.balance) + "\n"
             place += 1
         if highscore:
@@ -407,11 +3332,17 @@ class Economy:
         else:
             await self.bot.say("```css\nThere are no accounts in the bank.\n```")
 
-    def already_in_list(self, accounts, user):
-        for acc in accounts:
-            if user.id == acc.id:
-                return True
-        return False
+    @leaderboard.command(name="rank", pass_context=True)
+    async def _leaderboard_rank(self, ctx, user : discord.Member=None):
+        """Shows the leaderboard position of user
+        Defaults to yours"""
+        if not user:
+            user = ctx.message.author
+        rank = await self.bank.offload(self.bank.get_rank, user)
+        if rank is None:
+            await self.bot.say("```css\n{} does not have an account registered with the bank.\n```".format(user.name))
+        else:
+            await self.bot.say("```css\n{} is ranked {} on this server's leaderboard.\n```".format(user.name, rank))
 
     @commands.group(pass_context=True, no_pm=True)
     @checks.is_owner()
@@ -444,6 +3375,212 @@ class Economy:
         await self.bot.say("```css\nEvery payday will now give " + str(credits) + " credits.\n```")
         dataIO.save_json(self.file_path, self.settings)
 
+    @economyset.command()
+    async def journal(self):
+        """Toggles journaled bank storage
+
+        When enabled, every change is appended to bank.journal and the
+        bank snapshot is rewritten periodically instead of on every change."""
+        if await self._served_elsewhere():
+            return
+        if self.storage["BACKEND"] != "json":
+            await self.bot.say("```css\nJournaling is only available with the json backend.\n```")
+            return
+        self.storage["JOURNAL"] = not self.storage["JOURNAL"]
+        self.bank.set_journal(self.storage["JOURNAL"], fsync=self.storage["JOURNAL_FSYNC"])
+        dataIO.save_json(self.storage_file_path, self.storage)
+        if self.storage["JOURNAL"]:
+            await self.bot.say("```css\nJournaled storage enabled. The bank snapshot will be compacted every {}.\n```".format(self.display_time(self.storage["COMPACT_INTERVAL"])))
+        else:
+            await self.bot.say("```css\nJournaled storage disabled. The bank will be saved on every change.\n```")
+
+    @economyset.command()
+    async def backend(self, name : str):
+        """Switches bank storage between json, sharded, columnar and sqlite
+
+        Every account is copied into the new backend."""
+        if await self._served_elsewhere():
+            return
+        name = name.lower()
+        if name not in ("json", "sharded", "columnar", "sqlite"):
+            await self.bot.say("```css\nAvailable backends: json, sharded, columnar, sqlite.\n```")
+            return
+        if name == self.storage["BACKEND"]:
+            await self.bot.say("```css\nThe bank already uses the {} backend.\n```".format(name))
+            return
+        old_bank = self.bank
+        await old_bank.flush()
+        self.storage["BACKEND"] = name
+        new_bank = open_bank(self.bot, self.storage)
+        new_bank.load_accounts(old_bank.iter_accounts())
+        atexit.unregister(old_bank.close)
+        old_bank.close()
+        if old_bank.ledger is not None:
+            old_bank.ledger.close()
+        if new_bank.ledger is not None:
+            await new_bank.offload(new_bank.checkpoint_ledger)
+        new_bank.holds = old_bank.holds
+        self.bank = new_bank
+        atexit.register(new_bank.close)
+        dataIO.save_json(self.storage_file_path, self.storage)
+        await self.bot.say("```css\nThe bank now uses the {} backend.\n```".format(name))
+
+    @economyset.command()
+    async def snapshot(self, name : str):
+        """Switches the bank snapshot between binary and json
+
+        binary loads and saves much faster, json can be read and edited by hand."""
+        if await self._served_elsewhere():
+            return
+        name = name.lower()
+        if name not in ("binary", "json"):
+            await self.bot.say("```css\nAvailable snapshot formats: binary, json.\n```")
+            return
+        if self.storage["BACKEND"] != "json":
+            await self.bot.say("```css\nSnapshots are only used by the json backend.\n```")
+            return
+        self.storage["SNAPSHOT"] = name
+        self.bank.set_snapshot("data/economy/bank.bin" if name == "binary" else "data/economy/bank.json")
+        dataIO.save_json(self.storage_file_path, self.storage)
+        await self.bot.say("```css\nThe bank is now saved to {}.\n```".format(os.path.basename(self.bank.file_path)))
+
+    @economyset.command()
+    async def writebehind(self):
+        """Toggles deferred bank saving
+
+        When enabled, changes are kept in memory and the bank is written
+        from a background thread at most once per flush interval."""
+        if await self._served_elsewhere():
+            return
+        if self.storage["BACKEND"] == "sqlite":
+            await self.bot.say("```css\nDeferred saving isn't available with the sqlite backend.\n```")
+            return
+        self.storage["WRITE_BEHIND"] = not self.storage["WRITE_BEHIND"]
+        self.bank.write_behind = self.storage["WRITE_BEHIND"]
+        dataIO.save_json(self.storage_file_path, self.storage)
+        if self.storage["WRITE_BEHIND"]:
+            await self.bot.say("```css\nDeferred saving enabled. The bank will be saved at most every {}.\n```".format(self.display_time(self.storage["FLUSH_INTERVAL"])))
+        else:
+            await self.bank.flush()
+            await self.bot.say("```css\nDeferred saving disabled. The bank will be saved on every change.\n```")
+
+    @economyset.command()
+    async def service(self, address : str=None):
+        """Uses a bank service shared with other bot processes
+
+        Start it with casinobank/bankd.py, then pass its address, such as
+        unix:data/economy/bank.sock or tcp:127.0.0.1:8765. Leave the address
+        out to go back to the local bank."""
+        if address is not None:
+            try:
+                parse_address(address)
+            except ValueError as e:
+                await self.bot.say("```css\n{}\n```".format(e))
+                return
+        old_bank = self.bank
+        self.storage["SERVICE"] = address
+        try:
+            new_bank = open_bank(self.bot, self.storage)
+            await new_bank.offload(new_bank.count_accounts)  # Fails early if the service isn't reachable
+        except (OSError, BankError) as e:
+            self.storage["SERVICE"] = getattr(old_bank, "address", None)
+            await self.bot.say("```css\nCould not reach the bank service: {}\n```".format(e))
+            return
+        await old_bank.flush()
+        atexit.unregister(old_bank.close)
+        old_bank.close()
+        if old_bank.ledger is not None:
+            old_bank.ledger.close()
+        new_bank.holds = old_bank.holds
+        self.bank = new_bank
+        atexit.register(new_bank.close)
+        dataIO.save_json(self.storage_file_path, self.storage)
+        if address is None:
+            await self.bot.say("```css\nThe bank is now stored locally.\n```")
+        else:
+            await self.bot.say("```css\nThe bank is now served by {}.\n```".format(address))
+
+    async def _served_elsewhere(self):
+        if self.storage["SERVICE"]:
+            await self.bot.say("```css\nThe bank is served by {}. Change its storage there.\n```".format(self.storage["SERVICE"]))
+            return True
+        return False
+
+    @economyset.command()
+    async def ledger(self, action : str="verify"):
+        """Checks bank balances against the ledger
+
+        verify lists accounts that don't match, rebuild sets them back to
+        the balance their ledger ends with and toggle turns the ledger on
+        or off."""
+        action = action.lower()
+        if action not in ("verify", "rebuild", "toggle"):
+            await self.bot.say("```css\nAvailable actions: verify, rebuild, toggle.\n```")
+            return
+        if action == "toggle":
+            if await self._served_elsewhere():
+                return
+            self.storage["LEDGER"] = not self.storage["LEDGER"]
+            if self.storage["LEDGER"]:
+                self.bank.ledger = BankLedger(LEDGER_PATH)
+                async with self.bank.lock.all():  # Balances changed while it was off
+                    await self.bank.offload(self.bank.checkpoint_ledger)
+            else:
+                self.bank.ledger.close()
+                self.bank.ledger = None
+            dataIO.save_json(self.storage_file_path, self.storage)
+            if self.storage["LEDGER"]:
+                await self.bot.say("```css\nThe bank ledger is now enabled.\n```")
+            else:
+                await self.bot.say("```css\nThe bank ledger is now disabled.\n```")
+            return
+        try:
+            if action == "rebuild":
+                async with self.bank.lock.all():
+                    accounts = await self.bank.offload(self.bank.rebuild_from_ledger)
+                await self.bot.say("```css\n{} accounts have been restored from the ledger.\n```".format(len(accounts)))
+                return
+            mismatches, broken = await self.bank.offload(self.bank.verify_ledger)
+        except ServiceUnavailable:
+            raise
+        except BankError:
+            await self.bot.say("```css\nThe bank ledger is disabled.\n```")
+            return
+        if not mismatches and not broken:
+            await self.bot.say("```css\nEvery balance matches the ledger.\n```")
+            return
+        msg = ""
+        for server_id, user_id, expected, balance in mismatches[:20]:
+            msg += "{} on {}: ledger {}, bank {}\n".format(user_id, server_id, expected, balance)
+        for server_id, user_id in broken[:20]:
+            msg += "{} on {}: ledger entries don't add up\n".format(user_id, server_id)
+        msg += "{} mismatched and {} broken in total.".format(len(mismatches), len(broken))
+        await self.bot.say("```css\n{}\n```".format(msg))
+
+    @economyset.command()
+    async def flushinterval(self, seconds : int):
+        """Seconds between deferred bank saves"""
+        if seconds < 1:
+            seconds = 1
+        self.storage["FLUSH_INTERVAL"] = seconds
+        dataIO.save_json(self.storage_file_path, self.storage)
+        await self.bot.say("```css\nValue modified. The bank will be saved at most every " + self.display_time(seconds) + ".\n```")
+
+    @economyset.command()
+    async def stats(self):
+        """Shows bank operation counts and latencies"""
+        stats = await self.bank.offload(self.bank.stats)
+        msg = "```css\n{} with {} accounts, up {}.\n\n".format(stats["backend"], stats["accounts"],
+                                                              self.display_time(int(stats["uptime_seconds"])) or "0 seconds")
+        msg += "{:<12}{:>9}{:>7}{:>10}{:>10}{:>10}{:>12}\n".format("op", "count", "errors", "avg ms", "p50 ms", "p99 ms", "bytes")
+        for name, op in sorted(stats["operations"].items()):
+            msg += "{:<12}{:>9}{:>7}{:>10.2f}{:>10}{:>10}{:>12}\n".format(
+                name, op["count"], op["errors"], op["total_seconds"] / op["count"] * 1000,
+                "<{:g}".format(op["p50_seconds"] * 1000), "<{:g}".format(op["p99_seconds"] * 1000),
+                op["bytes"] or "")
+        msg += "```"
+        await self.bot.say(msg)
+
     def display_time(self, seconds, granularity=2):
         intervals = (
             ('weeks', 604800),
@@ -469,6 +3606,9 @@ def check_folders():
     if not os.path.exists("data/economy"):
         print("Creating data/economy folder...")
         os.makedirs("data/economy")
+    if not os.path.exists(EXPORT_DIR):
+        print("Creating {} folder...".format(EXPORT_DIR))
+        os.makedirs(EXPORT_DIR)
 
 
 def check_files():
@@ -483,6 +3623,11 @@ def check_files():
         print("Creating empty bank.json...")
         dataIO.save_json(f, {})
 
+    f = "data/economy/storage.json"
+    if not dataIO.is_valid_json(f):
+        print("Creating default economy's storage.json...")
+        dataIO.save_json(f, default_storage)
+
 
 def setup(bot):
     global logger
@@ -491,7 +3636,8 @@ def setup(bot):
     logger = logging.getLogger("red.economy")
     if logger.level == 0:  # Prevents the logger from being loaded again in case of module reload
         logger.setLevel(logging.INFO)
-        handler = logging.FileHandler(filename='data/economy/economy.log', encoding='utf-8', mode='a')
-        handler.setFormatter(logging.Formatter('%(asctime)s %(message)s', datefmt="[%d/%m/%Y %H:%M]"))
+        handler = logging.handlers.RotatingFileHandler(filename=LOG_FILE_PATH, encoding='utf-8', mode='a',
+                                                       maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUPS)
+        handler.setFormatter(ActivityFormatter())
         logger.addHandler(handler)
     bot.add_cog(Economy(bot))
\ No newline at end of file